@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Compares the size of the CTL specifications written for the two encodings
+of the changes of control nodes, on a dataset where k control nodes all
+change between two time points.
+
+    python benchmarks/control_encoding.py [--max-controls K] [--nusmv]
+
+With --nusmv, the time taken by NuSMV to check both models is also given.
+"""
+from __future__ import print_function
+
+import os
+import re
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from caspo.core import LogicalNetwork
+from caspo.core.clause import Clause
+from caspo.core.setup import Setup
+
+from caspots import modelchecking
+from caspots.dataset import Dataset, Experiment
+
+def make_instance(k):
+    controls = ["C%d" % i for i in range(k)]
+    dataset = Dataset("controls%d" % k, control_nodes=controls)
+    dataset.setup = Setup(["S"], [], ["R"] + controls)
+    dataset.stimulus = set(["S"])
+    dataset.readout = set(["R"] + controls)
+    exp = Experiment(0)
+    exp.add_mutation("S", 1)
+    for t, v in [(0, 0), (1, 1)]:
+        exp.add_obs(t, "R", v, 100*v)
+        for n in controls:
+            exp.add_obs(t, n, v, 100*v)
+    dataset.experiments[0] = exp
+    network = LogicalNetwork([(Clause.from_str("S"), "R")])
+    return dataset, network
+
+def spec_size(dataset, network, encoding):
+    smv = StringIO()
+    modelchecking.write_smv(smv, dataset, network, encoding=encoding)
+    specs = [l for l in smv.getvalue().splitlines() if l.startswith("CTLSPEC")]
+    text = "\n".join(specs)
+    return len(text), len(re.findall(r"\bU\b", text))
+
+def nusmv_time(dataset, network, encoding):
+    fd, smvfile = tempfile.mkstemp(".smv")
+    os.close(fd)
+    try:
+        start = time.time()
+        exact = modelchecking.verify(dataset, network, smvfile,
+                                        encoding=encoding)
+        return time.time() - start, exact
+    finally:
+        os.unlink(smvfile)
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--max-controls", type=int, default=6)
+    parser.add_argument("--nusmv", action="store_true", default=False)
+    args = parser.parse_args()
+
+    columns = ["k"]
+    for encoding in modelchecking.CTL_ENCODINGS:
+        columns += ["%s:chars" % encoding, "%s:until" % encoding]
+        if args.nusmv:
+            columns += ["%s:seconds" % encoding]
+    print("\t".join(columns))
+    for k in range(1, args.max_controls+1):
+        dataset, network = make_instance(k)
+        row = [str(k)]
+        verdicts = set()
+        for encoding in modelchecking.CTL_ENCODINGS:
+            row += map(str, spec_size(dataset, network, encoding))
+            if args.nusmv:
+                duration, exact = nusmv_time(dataset, network, encoding)
+                verdicts.add(exact)
+                row.append("%0.3f" % duration)
+        print("\t".join(row))
+        assert len(verdicts) <= 1, "encodings disagree for k=%d" % k
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Compares the decoding of models into networks with
+LogicalNetwork.from_hypertuples (legacy) and with NetworkDecoder (current),
+on the first models enumerated by identify.
+
+    python benchmarks/model_decoding.py [PKN DATASET] [--models N]
+
+By default, the first instance of datasets/benchmarks-A with noise is used.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from caspo.core import LogicalNetwork
+
+from caspots import identify
+from caspots.console import ConsoleIdentifier
+
+from sample_exclusion import ROOT, options
+
+def legacy(ctx, atoms):
+    tuples = (f.args() for f in atoms if f.name() == "dnf")
+    return LogicalNetwork.from_hypertuples(ctx.hypergraph, tuples)
+
+def current(ctx, atoms):
+    decoder = ctx.decoder
+    return decoder.network(decoder.positions(identify.dnf_pairs(atoms)))
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("pkn", nargs="?",
+        default=os.path.join(ROOT, "1", "pkn1_cmpr.sif"))
+    parser.add_argument("dataset", nargs="?",
+        default=os.path.join(ROOT, "1", "data1_cmpr_bn_1_noise_01.csv"))
+    parser.add_argument("--models", type=int, default=10000)
+    args = parser.parse_args()
+
+    opts = options(args.pkn, args.dataset)
+    opts.family = "all"
+    with ConsoleIdentifier(opts) as ctx:
+        models = []
+        ctx.identifier.solutions(lambda model: models.append(model.atoms()),
+                                    limit=args.models)
+        for name, decode in [("legacy", legacy), ("current", current)]:
+            start = time.time()
+            for atoms in models:
+                decode(ctx, atoms)
+            duration = time.time() - start
+            print("%s\t%d models\t%0.2fs\t%0.1f models/s" % (name,
+                    len(models), duration, len(models)/duration))
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Measures the throughput of ASPSolver.solution_samples as the number of
+excluded samples grows, with the exclusions given by the externals of slots
+grounded by blocks (current), each grounded in a program part of its own
+(per-part), or all added to a single program part (single-part).
+
+    python benchmarks/sample_exclusion.py [PKN DATASET] [--samples N]
+        [--family F] [--weight-tolerance W]
+
+By default, the first instance of datasets/benchmarks-A with noise is used.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from caspots import identify
+from caspots.console import ConsoleIdentifier
+
+ROOT = os.path.join(os.path.dirname(__file__), "..", "datasets", "benchmarks-A")
+
+class PerPartSolver(identify.ASPSolver):
+    def exclude(self, control, sample, k):
+        control.add("excl%d" % k, [], sample.asp_exclusion())
+        control.ground([("excl%d" % k, [])])
+
+class SinglePartSolver(identify.ASPSolver):
+    def exclude(self, control, sample, k):
+        control.add("excl", [], sample.asp_exclusion())
+        control.ground([("excl", [])])
+
+def options(pkn, dataset, family, weight_tolerance):
+    return Namespace(pkn=pkn, dataset=dataset, factor=100,
+            compact_dataset=False, dataset_cache=None,
+            max_clause_length=0, control_nodes=None, networks=None,
+            partial_bn=None, fixpoints=None, family=family,
+            mincard_tolerance=0, weight_tolerance=weight_tolerance,
+            enum_traces=False,
+            max_traces=10, fully_controllable=True, prune=True,
+            force_weight=None, force_size=None,
+            clingo_parallel_mode=None, portfolio=0, ground_cache=None,
+            split=0, split_jobs=0,
+            debug=False,
+            range_from=0, range_length=0)
+
+def throughput(args, solver_class, nb_samples, window):
+    with ConsoleIdentifier(args) as ctx:
+        solver = ctx.identifier
+        solver.__class__ = solver_class
+        rates = []
+        start = last = time.time()
+        for i, _ in enumerate(solver.solution_samples()):
+            if (i+1) % window == 0:
+                now = time.time()
+                rates.append(window / (now - last))
+                last = now
+            if i+1 == nb_samples:
+                break
+        return rates, time.time() - start
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("pkn", nargs="?",
+        default=os.path.join(ROOT, "1", "pkn1_cmpr.sif"))
+    parser.add_argument("dataset", nargs="?",
+        default=os.path.join(ROOT, "1", "data1_cmpr_bn_1_noise_01.csv"))
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--window", type=int, default=250)
+    parser.add_argument("--family", default="all")
+    parser.add_argument("--weight-tolerance", type=int, default=100)
+    args = parser.parse_args()
+
+    for name, solver_class in [("current", identify.ASPSolver),
+                                ("per-part", PerPartSolver),
+                                ("single-part", SinglePartSolver)]:
+        rates, duration = throughput(options(args.pkn, args.dataset,
+                                        args.family, args.weight_tolerance),
+                                        solver_class, args.samples, args.window)
+        print("%s\t%0.2fs\t%s" % (name, duration,
+                " ".join(["%0.1f" % r for r in rates])))
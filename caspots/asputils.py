@@ -24,10 +24,17 @@ class funset(set):
     def to_funset(self):
         return self
 
+    def facts(self):
+        """
+        Lines of the facts, in a fixed (sorted) order
+        """
+        for fact in sorted(map(str, self)):
+            yield "%s.\n" % fact
+
     def to_file(self, path):
-        open(path, 'w').write(self.to_str())
+        with open(path, 'w') as fd:
+            for line in self.facts():
+                fd.write(line)
 
     def to_str(self):
-        if len(self):
-            return ".\n".join(sorted(map(str, self)))+".\n"
-        return ""
+        return "".join(self.facts())
@@ -0,0 +1,294 @@
+
+import hashlib
+import os
+import pickle
+import shutil
+import sqlite3
+from subprocess import Popen, PIPE
+import tempfile
+import time
+
+import numpy as np
+
+from caspo.core.setup import Setup
+
+from .dataset import Observations
+
+def network_fingerprint(network):
+    """
+    Canonical representation of the formulas of a network
+    """
+    def clause_str(clause):
+        return "+".join(sorted("%s%s" % ("!" if s < 0 else "", v) \
+                                for v, s in clause))
+    formulas = ["%s=%s" % (n, "|".join(sorted(map(clause_str, clauses)))) \
+                    for n, clauses in network.formulas_iter()]
+    return ";".join(sorted(formulas))
+
+def dataset_fingerprint(dataset):
+    """
+    Hash of the content of a dataset relevant to model checking
+    """
+    h = hashlib.sha1()
+    def add(obj):
+        h.update(repr(obj).encode())
+    add(sorted(dataset.setup.stimuli))
+    add(sorted(dataset.setup.inhibitors))
+    add(sorted(dataset.setup.readouts))
+    add(sorted(dataset.control_nodes))
+    for eid, exp in sorted(dataset.experiments.items()):
+        add((eid, sorted(exp.mutations.items())))
+        for t, values in sorted(exp.obs.items()):
+            add((t, sorted(values.items())))
+    return h.hexdigest()
+
+NOT_CACHED = object()
+
+class VerdictCache(object):
+    """
+    On-disk cache of model-checking verdicts, keyed by the network, the
+    dataset content and the update semantics. A verdict is the identifier of
+    the failing experiment, or None for a true positive.
+
+    The least recently used entries are evicted beyond `max_entries`. The
+    number of entries is counted when the cache is opened, and then only
+    follows the insertions and evictions of this process.
+    """
+    commit_every = 64
+
+    def __init__(self, directory, max_entries=10**6):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(os.path.join(directory, "verdicts.sqlite"),
+                                    timeout=60)
+        self.db.execute("CREATE TABLE IF NOT EXISTS verdicts "\
+                        "(key TEXT PRIMARY KEY, failing INTEGER, used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS verdicts_used "\
+                        "ON verdicts (used)")
+        self.max_entries = max_entries
+        # number of rows, kept up to date by put and commit
+        self.count = self.db.execute("SELECT COUNT(*) FROM verdicts")\
+                        .fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.dirty = 0
+        self.fingerprints = {}
+
+    def fingerprint(self, dataset):
+        """
+        Returns the fingerprint of the dataset, computed once per dataset
+        object (see forget)
+        """
+        entry = self.fingerprints.get(id(dataset))
+        if entry is None or entry[0] is not dataset:
+            entry = (dataset, dataset_fingerprint(dataset))
+            self.fingerprints[id(dataset)] = entry
+        return entry[1]
+
+    def forget(self, dataset):
+        """
+        Drops the fingerprint of a dataset modified in place
+        """
+        self.fingerprints.pop(id(dataset), None)
+
+    def key(self, dataset, network, semantics):
+        h = hashlib.sha1()
+        h.update(self.fingerprint(dataset).encode())
+        h.update(semantics.encode())
+        h.update(network_fingerprint(network).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached verdict, or NOT_CACHED
+        """
+        row = self.db.execute("SELECT failing FROM verdicts WHERE key = ?",
+                                (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return NOT_CACHED
+        self.hits += 1
+        self.db.execute("UPDATE verdicts SET used = ? WHERE key = ?",
+                            (time.time(), key))
+        self.touch()
+        return row[0]
+
+    def put(self, key, failing):
+        now = time.time()
+        cur = self.db.execute("UPDATE verdicts SET failing = ?, used = ? "\
+                                "WHERE key = ?", (failing, now, key))
+        if cur.rowcount == 0:
+            self.db.execute("INSERT INTO verdicts VALUES (?, ?, ?)",
+                                (key, failing, now))
+            self.count += 1
+        self.touch()
+
+    def touch(self):
+        self.dirty += 1
+        if self.dirty >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        if self.count > self.max_entries:
+            excess = self.count - self.max_entries
+            cur = self.db.execute("DELETE FROM verdicts WHERE key IN "\
+                "(SELECT key FROM verdicts ORDER BY used LIMIT ?)", (excess,))
+            self.count -= cur.rowcount
+            self.evicted += cur.rowcount
+        self.db.commit()
+        self.dirty = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+    def __str__(self):
+        total = self.hits + self.misses
+        return "%d hit(s) / %d miss(es) [hit rate: %0.2f%%], %d evicted" \
+            % (self.hits, self.misses, (100.*self.hits)/total if total else 0,
+                self.evicted)
+
+class GroundCache(object):
+    """
+    On-disk cache of ground programs, as output by gringo --text, keyed by
+    the version of gringo and the content of the encodings and of the facts.
+    The facts reflect the PKN, the dataset and the options used to translate
+    them (factor, maximum clause length, control nodes, ...).
+
+    Without the gringo executable, programs are not cached (see program).
+    """
+    def __init__(self, directory, gringo="gringo"):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.gringo = gringo
+        self._version = None
+
+    def version(self):
+        """
+        Returns the output of gringo --version, or None if gringo cannot be run
+        """
+        if self._version is None:
+            try:
+                p = Popen([self.gringo, "--version"], stdout=PIPE, stderr=PIPE)
+            except OSError:
+                return None
+            self._version = p.communicate()[0].decode()
+        return self._version
+
+    def key(self, files, data):
+        h = hashlib.sha1()
+        h.update(self.version().encode())
+        for f in files:
+            with open(f, "rb") as fd:
+                h.update(hashlib.sha1(fd.read()).hexdigest().encode())
+        h.update(data.encode())
+        return h.hexdigest()
+
+    def program(self, files, data):
+        """
+        Returns the path to the ground program of the given files and facts,
+        grounding it if not cached, or None if gringo cannot be run
+        """
+        if self.version() is None:
+            return None
+        path = os.path.join(self.directory, "%s.lp" % self.key(files, data))
+        if os.path.exists(path):
+            return path
+        fd, tmp = tempfile.mkstemp(".lp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "w") as out:
+                p = Popen([self.gringo, "--text"] + list(files) + ["-"],
+                            stdin=PIPE, stdout=out)
+                p.communicate(data.encode())
+            if p.returncode != 0:
+                raise RuntimeError("%s exited with code %d" \
+                                    % (self.gringo, p.returncode))
+            os.rename(tmp, path)
+        except OSError:
+            os.unlink(tmp)
+            return None
+        except:
+            os.unlink(tmp)
+            raise
+        return path
+
+
+class DatasetCache(object):
+    """
+    On-disk cache of datasets loaded from MIDAS files, keyed by the content
+    of the file and the options of the discretization. Each entry is a
+    directory with the observation arrays (.npy files, memory-mapped when
+    loaded) and a pickled description of the setup and the experiments.
+    """
+    version = 1
+    arrays = ["values", "dvalues", "observed"]
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def key(self, midas, dataset, graph):
+        h = hashlib.sha1()
+        def add(obj):
+            h.update(repr(obj).encode())
+        add(self.version)
+        with open(midas, "rb") as fd:
+            add(hashlib.sha1(fd.read()).hexdigest())
+        add(dataset.dfactor)
+        add(dataset.discretize.__name__)
+        add(sorted(dataset.control_nodes))
+        # stimuli are clamped to 0 only when they have no predecessors
+        add(sorted(n for n in graph.nodes() if not len(graph.predecessors(n))))
+        return h.hexdigest()
+
+    def load(self, key, dataset):
+        """
+        Loads the cached dataset into `dataset`; returns False if not cached
+        """
+        path = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(path, "dataset.pickle"), "rb") as fd:
+                meta = pickle.load(fd)
+            arrays = [np.load(os.path.join(path, "%s.npy" % name),
+                                mmap_mode="c") for name in self.arrays]
+        except (IOError, OSError, ValueError, EOFError, pickle.PickleError):
+            return False
+        store = Observations(meta["eids"], meta["times"], meta["nodes"])
+        store.values, store.dvalues, store.observed = arrays
+        mutations = dict((eid, dict(m)) \
+                        for eid, m in zip(meta["eids"], meta["mutations"]))
+        setup = Setup(meta["stimuli"], meta["inhibitors"], meta["readouts"])
+        dataset.load_from_store(setup, mutations, store, meta["warnings"])
+        return True
+
+    def save(self, key, dataset):
+        path = os.path.join(self.directory, key)
+        if os.path.exists(path):
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        store = dataset.observations()
+        meta = {
+            "stimuli": dataset.setup.stimuli,
+            "inhibitors": dataset.setup.inhibitors,
+            "readouts": dataset.setup.readouts,
+            "eids": store.eids,
+            "times": store.times,
+            "nodes": store.nodes,
+            "mutations": [sorted(dataset.experiments[eid].mutations.items()) \
+                            for eid in store.eids],
+            "warnings": dataset.warnings,
+        }
+        tmp = tempfile.mkdtemp(dir=self.directory)
+        try:
+            for name in self.arrays:
+                np.save(os.path.join(tmp, "%s.npy" % name),
+                        np.ascontiguousarray(getattr(store, name)))
+            with open(os.path.join(tmp, "dataset.pickle"), "wb") as fd:
+                pickle.dump(meta, fd, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, path)
+        except:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.exists(path):
+                raise
@@ -1,11 +1,21 @@
 
 from __future__ import print_function
 
-from functools import reduce
+from collections import OrderedDict, deque
+from functools import reduce, wraps
+import multiprocessing
+import multiprocessing.util
 import os
+import pickle
+import shutil
 import sys
 import tempfile
 
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
 import gringo
 
 from caspo.core import Graph, HyperGraph, LogicalNetwork, LogicalNetworkList
@@ -15,13 +25,17 @@ from .fixpoint import *
 from .utils import *
 from .asputils import *
 from .dataset import *
+from .cache import DatasetCache, GroundCache, VerdictCache, NOT_CACHED
+from .instrument import PROFILE, worker_profile
 from caspots import identify
 from caspots import modelchecking
+from caspots import native
 
 
 def read_pkn(args):
-    graph = Graph.read_sif(args.pkn)
-    hypergraph = HyperGraph.from_graph(graph, args.max_clause_length)
+    with PROFILE.phase("hypergraph"):
+        graph = Graph.read_sif(args.pkn)
+        hypergraph = HyperGraph.from_graph(graph, args.max_clause_length)
     return graph, hypergraph
 
 def dataset_name(args):
@@ -37,9 +51,23 @@ def control_nodes(args, graph):
 
 def read_dataset(args, graph):
     ds = Dataset(dataset_name(args), dfactor=args.factor,
-                    control_nodes=control_nodes(args, graph))
+                    control_nodes=control_nodes(args, graph),
+                    compact=args.compact_dataset)
     if args.dataset != "EMPTY":
-        ds.load_from_midas(args.dataset, graph)
+        with PROFILE.phase("midas"):
+            if args.dataset_cache:
+                cache = DatasetCache(args.dataset_cache)
+                key = cache.key(args.dataset, ds, graph)
+                if cache.load(key, ds):
+                    dbg("# dataset loaded from cache %s" % key)
+                else:
+                    ds.load_from_midas(args.dataset, graph)
+                    try:
+                        cache.save(key, ds)
+                    except (IOError, OSError) as e:
+                        dbg("# dataset not cached: %s" % e)
+            else:
+                ds.load_from_midas(args.dataset, graph)
 
     if not ds.setup.stimuli:
         dbg("# PKN has no stimuli: setting fully_controllable = False.")
@@ -81,23 +109,407 @@ def read_fixpoints(args):
         fps = Fixpoint.from_file(args.fixpoints)
         return reduce(lambda a, b: a.push(b), fps, funset())
 
-def is_true_positive(args, dataset, network):
-    fd, smvfile = tempfile.mkstemp(".smv")
-    os.close(fd)
-    exact = modelchecking.verify(dataset, network, smvfile, args.semantics)
+def prune(args, hypergraph, dataset, fixpoints=None):
+    readouts = set(dataset.setup.readouts)
+    if fixpoints:
+        # see fixpoints.lp
+        readouts.update([f.args()[1] for f in fixpoints if f.name() == "fp"])
+    pruned = prune_hypergraph(hypergraph, dataset.setup.stimuli, readouts,
+                    controllable=args.fully_controllable,
+                    keep=set(dataset.setup.inhibitors).union(dataset.control_nodes))
+    dbg("# pruning: %d/%d hyperedge(s) and %d/%d node(s) removed" \
+        % (len(hypergraph.hyper) - len(pruned.hyper), len(hypergraph.hyper),
+            len(hypergraph.nodes) - len(pruned.nodes), len(hypergraph.nodes)))
+    return pruned
+
+_checkers = {}
+
+def checker(args):
+    """
+    Returns the model checker of the current process
+    """
+    pid = os.getpid()
+    if pid not in _checkers:
+        if args.checker == "native":
+            session = native.NativeChecker(args.semantics, args.max_states,
+                                            tmpdir=args.tmpdir)
+        else:
+            session = modelchecking.NuSMVSession(args.semantics,
+                                                    tmpdir=args.tmpdir)
+        # also run when pool workers exit
+        multiprocessing.util.Finalize(session, session.close, exitpriority=10)
+        _checkers[pid] = session
+    return _checkers[pid]
+
+_caches = {}
+
+def verdict_cache(args):
+    """
+    Returns the verdict cache of the current process, or None if disabled
+    """
+    if not args.cache_dir:
+        return None
+    pid = os.getpid()
+    if pid not in _caches:
+        cache = VerdictCache(args.cache_dir, args.cache_size)
+        multiprocessing.util.Finalize(cache, cache.close, exitpriority=10)
+        _caches[pid] = cache
+    return _caches[pid]
+
+def report_cache(args):
+    cache = _caches.get(os.getpid())
+    if cache is not None:
+        dbg("# verdict cache: %s" % cache)
+
+class SharedVerdicts(object):
+    """
+    Shares the verdicts (or pending jobs) of networks having the same
+    projection on the cones of influence of the experiments
+    (see modelchecking.network_projection).
+    At most `size` projections are kept, the least recently used ones being
+    dropped first.
+    """
+    def __init__(self, dataset, size=2**16):
+        self.dataset = dataset
+        self.size = size
+        self.verdicts = OrderedDict()
+        self.saved = 0
+        self.checked = 0
+
+    def key(self, network):
+        return modelchecking.network_projection(self.dataset, network)
+
+    def get(self, network, compute, key=None):
+        """
+        Returns the verdict of a network with the same projection, or
+        the result of compute()
+        """
+        if key is None:
+            key = self.key(network)
+        if key in self.verdicts:
+            self.saved += 1
+            verdict = self.verdicts.pop(key)
+        else:
+            self.checked += 1
+            verdict = compute()
+            if len(self.verdicts) >= self.size:
+                self.verdicts.popitem(last=False)
+        self.verdicts[key] = verdict
+        return verdict
+
+    def resolve(self, key, job, failing):
+        """
+        Replaces the pending job shared for `key` by its verdict
+        """
+        if self.verdicts.get(key) is job:
+            self.verdicts[key] = KnownVerdict(failing)
+
+    def __str__(self):
+        return "%d model-checking(s) saved for %d projection(s) checked" \
+                % (self.saved, self.checked)
+
+def model_check(args, dataset, network, exp_ids=None):
+    """
+    Returns the first failing experiment of the network, or None
+    """
     if args.debug:
+        fd, smvfile = tempfile.mkstemp(".smv", dir=args.debug_dir)
+        os.close(fd)
+        modelchecking.make_smv(dataset, network, smvfile, args.semantics)
         dbg("# %s" % smvfile)
+    with PROFILE.timed("model-checking"):
+        return checker(args).failing_experiment(dataset, network, exp_ids)
+
+def failing_experiment(args, dataset, network):
+    cache = verdict_cache(args)
+    if cache is None:
+        return model_check(args, dataset, network)
+    key = cache.key(dataset, network, args.semantics)
+    failing = cache.get(key)
+    if failing is NOT_CACHED:
+        failing = model_check(args, dataset, network)
+        cache.put(key, failing)
+    return failing
+
+def sample_trace(args, sample, dataset):
+    trace = sample.trace(dataset)
+    cache = verdict_cache(args)
+    if cache is not None:
+        # the dataset is rewritten in place
+        cache.forget(trace)
+    return trace
+
+def is_true_positive(args, dataset, network):
+    return failing_experiment(args, dataset, network) is None
+
+_worker = {}
+
+def _init_worker(args, dataset, networks=None, generation=None):
+    _worker["args"] = args
+    _worker["dataset"] = dataset
+    _worker["networks"] = networks
+    _worker["generation"] = generation
+    if args.profile_json:
+        worker_profile()
+
+def _profiled(func):
+    """
+    Task of a worker returning, with its result, the latencies recorded
+    meanwhile (see _result)
+    """
+    @wraps(func)
+    def task(*args):
+        return func(*args), PROFILE.take()
+    return task
+
+def _result(output):
+    """
+    Result of a _profiled task, its latencies being merged into the profile
+    """
+    result, histograms = output
+    PROFILE.merge(histograms)
+    return result
+
+class WorkerJob(object):
+    """
+    Pending _profiled task, whose latencies are merged once however many
+    times its result is got
+    """
+    def __init__(self, job):
+        self.job = job
+        self.result = None
+
+    def ready(self):
+        return self.job.ready()
+
+    def get(self):
+        if self.result is None:
+            self.result = (_result(self.job.get()),)
+        return self.result[0]
+
+@_profiled
+def _validate_networks(indexes):
+    return [model_check(_worker["args"], _worker["dataset"],
+                            _worker["networks"][i]) for i in indexes]
+
+@_profiled
+def _validate_batch(indexes):
+    networks = [_worker["networks"][i] for i in indexes]
+    with PROFILE.timed("model-checking-batch"):
+        return checker(_worker["args"]).failing_experiments(_worker["dataset"],
+                                                                networks)
+
+@_profiled
+def _validate_experiments(index, exp_ids, generation):
+    if _worker["generation"].value != generation:
+        # the verdict of the network is already known (see split_experiments)
+        return None
+    return model_check(_worker["args"], _worker["dataset"],
+                            _worker["networks"][index], exp_ids)
+
+@_profiled
+def _check_network(network, trace=None):
+    dataset = _worker["dataset"] if trace is None else pickle.loads(trace)
+    return model_check(_worker["args"], dataset, network)
+
+def split_experiments(pool, args, dataset, index, generation):
+    """
+    Returns the first failing experiment of the network at `index`, its
+    experiments being checked by all the workers of the pool.
+
+    `generation` is shared with the workers (see _init_worker) and is
+    incremented on return: the chunks of experiments not started yet are
+    then skipped by the workers.
+    """
+    exp_ids = sorted(dataset.experiments)
+    chunks = [exp_ids[i::args.jobs] for i in range(args.jobs)]
+    results = Queue()
+    # the results of the chunks still running on return are merged as well
+    jobs = [pool.apply_async(_validate_experiments,
+                    (index, chunk, generation.value),
+                    callback=lambda output: results.put(_result(output))) \
+                for chunk in chunks if chunk]
+    try:
+        for _ in jobs:
+            while True:
+                try:
+                    failing = results.get(timeout=1)
+                    break
+                except Empty:
+                    # no callback for the chunks raising an exception
+                    for job in jobs:
+                        if job.ready() and not job.successful():
+                            job.get()
+            if failing is not None:
+                return failing
+        return None
+    finally:
+        generation.value += 1
+
+def network_batches(networks, indexes, size):
+    """
+    Splits the networks at the given indexes into batches of at most `size`
+    networks defining formulas for the same nodes
+    """
+    groups = {}
+    for i in indexes:
+        key = frozenset([n for n, _ in networks[i].formulas_iter()])
+        groups.setdefault(key, []).append(i)
+    batches = []
+    for group in groups.values():
+        batches += [group[k:k+size] for k in range(0, len(group), size)]
+    return sorted(batches)
+
+def validate_networks(args, dataset, networks, shared):
+    """
+    Yields the first failing experiment of each network (None for true
+    positives), in order.
+    Only one network per projection (see SharedVerdicts) is model-checked.
+    With args.batch > 1, networks defining formulas for the same nodes are
+    model-checked together (see NuSMVSession.failing_experiments).
+    With args.jobs > 1, networks are model-checked by a pool of worker
+    processes; when there are fewer networks than workers, the experiments of
+    each network are split among them.
+    """
+    # cached verdicts are looked up here, the workers only check the others
+    cache = verdict_cache(args)
+    keys = {}
+    verdicts = {}
+    if cache is not None:
+        for i, network in enumerate(networks):
+            keys[i] = cache.key(dataset, network, args.semantics)
+            failing = cache.get(keys[i])
+            if failing is not NOT_CACHED:
+                verdicts[i] = failing
+    members = {}
+    for i in range(len(networks)):
+        if i not in verdicts:
+            members.setdefault(shared.get(networks[i], lambda: i), []).append(i)
+    todo = sorted(members)
+    if args.batch > 1:
+        tasks = network_batches(networks, todo, args.batch)
+        func = _validate_batch
+    else:
+        tasks = [[i] for i in todo]
+        func = _validate_networks
+
+    if args.jobs > 1:
+        generation = multiprocessing.Value("i", 0, lock=False)
+        pool = multiprocessing.Pool(args.jobs, _init_worker,
+                                        (args, dataset, networks, generation))
+        if len(todo) < args.jobs and len(dataset.experiments) > 1:
+            tasks = [[i] for i in todo]
+            results = ([split_experiments(pool, args, dataset, task[0],
+                                            generation)] for task in tasks)
+        else:
+            results = (_result(output) for output in pool.imap(func, tasks))
     else:
-        os.unlink(smvfile)
-    return exact
+        pool = None
+        _init_worker(args, dataset, networks)
+        results = (_result(func(task)) for task in tasks)
+
+    closed = False
+    try:
+        nxt = 0
+        for task in [[]] + tasks:
+            if task:
+                for i, failing in zip(task, next(results)):
+                    for j in members[i]:
+                        verdicts[j] = failing
+                        if cache is not None:
+                            cache.put(keys[j], failing)
+            while nxt in verdicts:
+                yield verdicts.pop(nxt)
+                nxt += 1
+        if pool is not None:
+            pool.close()
+        closed = True
+    finally:
+        if pool is not None:
+            if not closed:
+                pool.terminate()
+            pool.join()
+
+class KnownVerdict(object):
+    def __init__(self, failing):
+        self.failing = failing
+
+    def ready(self):
+        return True
+
+    def get(self):
+        return self.failing
+
+class CheckerPool(object):
+    """
+    Model-checks networks in worker processes while the caller goes on
+    producing them.
+
+    Verdicts are delivered to `callback(network, failing, *payload)` in
+    submission order. At most `backlog` networks are pending: `submit` blocks
+    on the oldest one beyond that bound.
+    """
+    def __init__(self, args, dataset, callback, shared, backlog=None):
+        self.args = args
+        self.dataset = dataset
+        self.callback = callback
+        self.shared = shared
+        self.backlog = backlog or 4*args.jobs
+        self.pending = deque()
+        self.pool = multiprocessing.Pool(args.jobs, _init_worker,
+                                            (args, dataset))
+
+    def submit(self, network, trace=None, *payload):
+        cache = verdict_cache(self.args)
+        key = job = None
+        if cache is not None:
+            dataset = self.dataset if trace is None else trace
+            key = cache.key(dataset, network, self.args.semantics)
+            failing = cache.get(key)
+            if failing is not NOT_CACHED:
+                key = None
+                job = KnownVerdict(failing)
+        shared = None
+        if job is None and trace is None:
+            shared = self.shared.key(network)
+            job = self.shared.get(network, lambda: WorkerJob(\
+                    self.pool.apply_async(_check_network, (network,))), shared)
+        elif job is None:
+            # the trace may be modified in place by the next sample
+            trace = pickle.dumps(trace, pickle.HIGHEST_PROTOCOL)
+            job = WorkerJob(self.pool.apply_async(_check_network,
+                                                    (network, trace)))
+        self.pending.append((job, key, shared, network, payload))
+        while len(self.pending) > self.backlog \
+                or (self.pending and self.pending[0][0].ready()):
+            self.deliver()
+
+    def deliver(self):
+        job, key, shared, network, payload = self.pending.popleft()
+        failing = job.get()
+        if key is not None:
+            verdict_cache(self.args).put(key, failing)
+        if shared is not None:
+            self.shared.resolve(shared, job, failing)
+        self.callback(network, failing, *payload)
+
+    def join(self):
+        while self.pending:
+            self.deliver()
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        self.pool.terminate()
+        self.pool.join()
 
 def do_pkn2lp(args):
     funset(read_pkn(args)[1]).to_file(args.output)
 
 def do_midas2lp(args):
-    graph, _ = read_pkn(args)
+    graph, hypergraph = read_pkn(args)
     dataset = read_dataset(args, graph)
-    funset(dataset).to_file(args.output)
+    funset(dataset, SupportDomain(hypergraph, dataset)).to_file(args.output)
 
 def do_results2lp(args):
     graph, hypergraph = read_pkn(args)
@@ -127,21 +539,40 @@ class ConsoleIdentifier(object):
         os.close(fd)
         domain, hypergraph = read_domain(args, hypergraph, dataset, self.domainlp)
 
-        termset = funset(hypergraph, dataset)
+        fixpoints = read_fixpoints(args)
+
+        # the networks and partial BN refer to hyperedges which may be pruned
+        if args.prune and domain is None and not args.partial_bn:
+            with PROFILE.phase("pruning"):
+                pruned = prune(args, hypergraph, dataset, fixpoints)
+        else:
+            pruned = hypergraph
+
+        with PROFILE.phase("facts"):
+            termset = funset(pruned, dataset, SupportDomain(pruned, dataset))
 
         fd, self.restrictlp = tempfile.mkstemp(".lp")
         os.close(fd)
         restrict = read_restriction(args, hypergraph, self.restrictlp)
 
-        fixpoints = read_fixpoints(args)
         if fixpoints:
             termset.update(fixpoints)
 
-        identifier = identify.ASPSolver(termset, args, domain=domain,
+        ground_cache = GroundCache(args.ground_cache) \
+                            if args.ground_cache else None
+        if ground_cache is not None and ground_cache.version() is None:
+            warning("%s cannot be run: the ground program is not cached" \
+                        % ground_cache.gringo)
+            ground_cache = None
+
+        with PROFILE.phase("facts"):
+            identifier = identify.ASPSolver(termset, args, domain=domain,
                                         restrict=restrict, fixpoints=fixpoints,
-                                        nodataset=not dataset.experiments)
+                                        nodataset=not dataset.experiments,
+                                        ground_cache=ground_cache)
         return Ctx(identifier = identifier,
                 hypergraph = hypergraph,
+                decoder = NetworkDecoder(hypergraph),
                 dataset = dataset)
 
     def __exit__(self, type, value, traceback):
@@ -149,6 +580,18 @@ class ConsoleIdentifier(object):
         os.unlink(self.restrictlp)
 
 
+def print_residuals(residuals):
+    """
+    Prints the mean squared error and the number of values of each
+    experiment, time point and node, by decreasing contribution to the error
+    """
+    for name in ["experiment", "time", "node"]:
+        groups = residuals[name]
+        print("# squared errors by %s" % name)
+        for label in sorted(groups, key=lambda l: (-groups[l][0], l)):
+            total, count = groups[label]
+            print("%s\t%s\t%d" % (label, total/count, count))
+
 def do_mse(args):
     first = True
     exact = False
@@ -161,12 +604,15 @@ def do_mse(args):
                     print("MSE_sample >= MSE_discrete")
                 else:
                     print("MSE_sample >= %s" % mse)
+                if args.residuals:
+                    print_residuals(sample.residuals())
             if args.check_exact:
-                network = sample.network(ctx.hypergraph)
-                trace = sample.trace(ctx.dataset)
+                network = sample.network(ctx.decoder)
+                trace = sample_trace(args, sample, ctx.dataset)
                 exact = is_true_positive(args, trace, network)
                 if exact:
                     break
+                sample.reject_trace()
             else:
                 break
             first = False
@@ -175,6 +621,7 @@ def do_mse(args):
             print("MSE_sample is exact")
         else:
             print("MSE_sample may be under-estimated (no True Positive found)")
+        report_cache(args)
 
 
 def do_identify(args):
@@ -191,9 +638,21 @@ def do_identify(args):
 
     with ConsoleIdentifier(args) as ctx:
 
-        networks = LogicalNetworkList.from_hypergraph(ctx.hypergraph)
+        networks = NetworkWriter(args.output, ctx.hypergraph)
+
+        if args.refine and args.true_positives:
+            if args.family == "subset" \
+                    or (args.family == "mincard" and args.mincard_tolerance):
+                warning("--refine is ignored when enumerating subset-minimal networks")
+                learned = None
+            else:
+                learned = set()
+                edges = hyperedges(ctx.hypergraph)
+        else:
+            learned = None
 
-        def update(network, exact, new=True):
+        def update(network, failing, new=True, learn=False):
+            exact = failing is None
             if new:
                 c["found"] += 1
             if args.true_positives and exact:
@@ -201,40 +660,80 @@ def do_identify(args):
             show_stats()
             if not args.true_positives or exact:
                 networks.append(network)
+            elif learn and learned is not None:
+                # networks with the same formulas in the cone of influence
+                # of the failing experiment are rejected as well
+                cone, clamped = modelchecking.cone_of_influence(ctx.dataset,
+                                                        network, failing)
+                learned.add(network_exclusion(ctx.hypergraph, network,
+                                                cone, clamped, edges))
+
+        shared = SharedVerdicts(ctx.dataset)
+        if args.true_positives and args.jobs > 1:
+            pool = CheckerPool(args, ctx.dataset, update, shared)
+        else:
+            pool = None
+
+        def check(network, trace=None, new=True, learn=False):
+            if pool is not None:
+                pool.submit(network, trace, new, learn)
+            elif trace is None:
+                update(network, shared.get(network, lambda: \
+                    failing_experiment(args, ctx.dataset, network)), new, learn)
+            else:
+                update(network, failing_experiment(args, trace, network),
+                        new, learn)
 
         def on_model(model):
-            tuples = (f.args() for f in model.atoms() if f.name() == "dnf")
-            network = LogicalNetwork.from_hypertuples(ctx.hypergraph, tuples)
-            tp = args.true_positives and is_true_positive(args, ctx.dataset, network)
-            update(network, tp)
+            decoder = ctx.decoder
+            network = decoder.network(decoder.positions(
+                                        identify.dnf_pairs(model.atoms())))
+            if args.true_positives:
+                check(network, learn=True)
+            else:
+                update(network, None)
 
         if args.true_positives:
-            known_networks = set()
+            last = {"network": None}
             def on_model_with_errors(sample):
-                network = sample.network(ctx.hypergraph)
-                trace = sample.trace(ctx.dataset)
+                positions = ctx.decoder.positions(sample.dnf)
+                network = ctx.decoder.network(positions)
+                trace = sample_trace(args, sample, ctx.dataset)
                 if args.enum_traces:
-                    h = hash(tuple(network.to_array(ctx.hypergraph.mappings)))
-                    new = h not in known_networks
-                    if new:
-                        known_networks.add(h)
+                    # the traces of a network are sampled consecutively, and
+                    # the next one only if this one is rejected
+                    new = tuple(positions) != last["network"]
+                    last["network"] = tuple(positions)
+                    failing = failing_experiment(args, trace, network)
+                    if failing is not None:
+                        sample.reject_trace()
+                    update(network, failing, new)
                 else:
-                    new = True
-                tp = is_true_positive(args, trace, network)
-                update(network, tp, new)
+                    check(network, trace)
         else:
             on_model_with_errors = None
 
         try:
             ctx.identifier.solutions(on_model, on_model_with_errors,
-                    limit=args.limit, force_weight=args.force_weight)
+                    limit=args.limit, force_weight=args.force_weight,
+                    learned=learned)
+            if pool is not None:
+                pool.join()
+                pool = None
         finally:
-            print("%d solution(s) for the over-approximation" % c["found"])
+            if pool is not None:
+                pool.terminate()
+            if learned is None:
+                print("%d solution(s) for the over-approximation" % c["found"])
+            else:
+                print("%d solution(s) of the over-approximation checked" % c["found"])
             if args.true_positives and c["found"]:
                 print("%d/%d true positives [rate: %0.2f%%]" \
                     % (c["tp"], c["found"], (100.*c["tp"])/c["found"]))
-            if networks:
-                networks.to_csv(args.output)
+            if args.true_positives:
+                dbg("# cone-of-influence sharing: %s" % shared)
+            report_cache(args)
+            networks.close()
 
 
 
@@ -247,20 +746,31 @@ def do_validate(args):
     c = 0
     nb = len(networks)
     tp_indexes = []
+    rejections = {}
+    shared = SharedVerdicts(dataset)
     try:
-        for network in networks:
+        for failing in validate_networks(args, dataset, networks, shared):
             c += 1
             sys.stderr.write("%d/%d... " % (c,nb))
             sys.stderr.flush()
-            if is_true_positive(args, dataset, network):
+            if failing is None:
                 tp_indexes.append(c-1)
                 tp += 1
+            else:
+                rejections[failing] = rejections.get(failing, 0) + 1
+                if args.debug:
+                    dbg("# network %d rejected by experiment %d" \
+                            % (args.range_from + c-1, failing))
             sys.stderr.write("%d/%d true positives\r" % (tp,c))
         res = "%d/%d true positives [rate: %0.2f%%]" % (tp, nb, (100.*tp)/nb)
         print(res)
+        for eid, count in sorted(rejections.items()):
+            print("%d network(s) rejected by experiment %d" % (count, eid))
         if args.tee:
             with open(args.tee, "w") as f:
                 f.write("%s\n" % res)
+        dbg("# cone-of-influence sharing: %s" % shared)
+        report_cache(args)
     finally:
         if args.output and tp_indexes:
             networks[tp_indexes].to_csv(args.output)
@@ -273,6 +783,8 @@ def run():
     parser = ArgumentParser(prog=sys.argv[0])
     parser.add_argument("--debug", action="store_true", default=False)
     parser.add_argument("--debug-dir", type=str, default=tempfile.gettempdir())
+    parser.add_argument("--profile-json", type=str, default=None,
+        help="Write the timeline of the run, the model-checking latencies and the clingo statistics to the given file (json format)")
     subparsers = parser.add_subparsers(help="commands help")
 
     identify_parser = ArgumentParser(add_help=False)
@@ -286,11 +798,15 @@ def run():
     identify_parser.add_argument("--enum-traces", action="store_true",
                                     default=False,
                                     help="enumerate over traces")
+    identify_parser.add_argument("--max-traces", type=int, default=10,
+                                    help="with --enum-traces, maximum number of traces tried per network (default: 10)")
     identify_parser.add_argument("--fully-controllable", action="store_true",
                                     help="only consider BNs where all nodes have a stimulus in their ancestors (default)")
     identify_parser.add_argument("--no-fully-controllable", action="store_false", dest="fully_controllable",
                                     help="do not only consider BNs where all nodes have a stimulus in their ancestors")
     identify_parser.set_defaults(fully_controllable=True)
+    identify_parser.add_argument("--no-prune", action="store_false", dest="prune",
+                                    help="do not remove beforehand the hyperedges which cannot be used by any BN (not observable or, with --fully-controllable, not controllable)")
     identify_parser.add_argument("--force-weight", type=int, default=None,
                                     help="Force the maximum weight of a solution")
     identify_parser.add_argument("--force-size", type=int, default=None,
@@ -300,6 +816,17 @@ def run():
         choices=modelchecking.MODES, default=modelchecking.U_GENERAL,
         help="Updating mode of the Boolean network (default: %s)" \
             % modelchecking.U_GENERAL)
+    modelchecking_p.add_argument("--checker", choices=["nusmv", "native"],
+        default="nusmv",
+        help="Model checker: NuSMV, or native explicit-state exploration falling back to NuSMV on large state spaces (default: nusmv)")
+    modelchecking_p.add_argument("--max-states", type=int, default=2**16,
+        help="Maximum number of states explored by the native model checker (default: %d)" % 2**16)
+    modelchecking_p.add_argument("--cache-dir", type=str, default=None,
+        help="Directory of the persistent cache of model-checking verdicts (default: no cache)")
+    modelchecking_p.add_argument("--cache-size", type=int, default=10**6,
+        help="Maximum number of cached verdicts (default: %d)" % 10**6)
+    modelchecking_p.add_argument("--jobs", type=int, default=1,
+        help="Number of model-checking processes (default: 1)")
 
     pkn_parser = ArgumentParser(add_help=False)
     pkn_parser.add_argument("pkn", help="Prior knowledge network (sif format)")
@@ -311,6 +838,10 @@ def run():
                                     help="discretization factor (default: 100)")
     dataset_parser.add_argument("--control-nodes", type=str, default=None,
             help="Comma-separated list of control nodes")
+    dataset_parser.add_argument("--compact-dataset", action="store_true",
+            help="Store the observations in dense arrays (less memory on large datasets)")
+    dataset_parser.add_argument("--dataset-cache", type=str, default=None,
+            help="Directory of the cache of parsed datasets (default: no cache)")
 
     networks_parser = ArgumentParser(add_help=False)
     networks_parser.add_argument("--range-from", type=int, default=0,
@@ -327,6 +858,14 @@ def run():
     clingo_options = ArgumentParser(add_help=False)
     clingo_options.add_argument("--clingo-parallel-mode", type=str,
         help="--parallel-mode option for clingo ")
+    clingo_options.add_argument("--ground-cache", type=str, default=None,
+        help="Directory of the cache of ground programs, reused by later runs on the same instance (default: no cache)")
+    clingo_options.add_argument("--split", type=int, default=0,
+        help="Split the enumeration into 2^K disjoint cubes over K dnf atoms, enumerated in separate processes (default: 0; not with --refine)")
+    clingo_options.add_argument("--split-jobs", type=int, default=0,
+        help="Number of processes enumerating the cubes of --split (default: number of CPUs)")
+    clingo_options.add_argument("--portfolio", type=int, default=0,
+        help="Race the first N of %d clingo configurations in separate processes for the initial optimization (default: 0, i.e., default configuration only)" % len(identify.PORTFOLIO))
 
     parser_pkn2lp = subparsers.add_parser("pkn2lp",
         help="Export PKN (sif format) to ASP (lp format)",
@@ -358,6 +897,8 @@ def run():
                     modelchecking_p, domain_parser, clingo_options])
     parser_mse.add_argument("--check-exact", action="store_true", default=False,
                             help="look for a true positive with the computed MSE")
+    parser_mse.add_argument("--residuals", action="store_true", default=False,
+                            help="print the squared errors of the sample by experiment, time point and node")
     parser_mse.set_defaults(func=do_mse)
 
     parser_identify = subparsers.add_parser("identify",
@@ -366,6 +907,8 @@ def run():
                     modelchecking_p, domain_parser, clingo_options])
     parser_identify.add_argument("--true-positives", default=False, action="store_true",
         help="filter solutions to keep only true positives (exact identification)")
+    parser_identify.add_argument("--refine", default=False, action="store_true",
+        help="with --true-positives, exclude from the enumeration the networks sharing the formulas responsible for a rejection (not with subset-minimal networks)")
     parser_identify.add_argument("--limit", default=0, type=int,
         help="Limit the number of solutions")
     parser_identify.add_argument("output", help="output file (csv format)")
@@ -379,6 +922,8 @@ def run():
         help="Validate only networks from given row (starting at 0)")
     parser_validate.add_argument("--range-length", type=int, default=0,
         help="Number of networks to validate (0 means all)")
+    parser_validate.add_argument("--batch", type=int, default=1,
+        help="Number of networks defining formulas for the same nodes to model-check at once (default: 1)")
     parser_validate.add_argument("--output", 
         help="output true positive network to file (csv format)")
     parser_validate.add_argument("--tee", type=str, default=None,
@@ -393,5 +938,13 @@ def run():
             continue
         print("# %s = %s" % (k,v))
     print("###################")
-    args.func(args)
+    # temporary files of the model checkers, also those of the pool workers
+    # which are not cleaned up when the pool is terminated
+    args.tmpdir = tempfile.mkdtemp(prefix="caspots-")
+    try:
+        args.func(args)
+    finally:
+        shutil.rmtree(args.tmpdir, ignore_errors=True)
+        if args.profile_json:
+            PROFILE.write(args.profile_json)
 
@@ -1,4 +1,5 @@
 
+import collections
 import sys
 
 import pandas as pd
@@ -14,7 +15,36 @@ from .asputils import *
 from .utils import *
 
 
-class Experiment:
+class BaseExperiment(object):
+    __slots__ = ()
+
+    def commit(self):
+        """
+        Warns if the experiment has a single data point; returns the warning
+        message, if any
+        """
+        if len(self.obs) == 1:
+            msg = "Experiment %d with clamping %s has only one data point (at time=%d)!"\
+                        % (self.id, self.mutations, list(self.obs.keys())[0])
+            warning(msg)
+            return msg
+
+    def __str__(self):
+        buf = "Experiment(%d):\n" % self.id
+        for a, c in sorted(self.mutations.items()):
+            buf += "\t%2d %s\n" % (c,a)
+        buf += "----\n"
+        for t, values in sorted(self.obs.items()):
+            buf += "\t%4d |" % t
+            for n, v in sorted(values.items()):
+                buf += "\t%s=%d" % (n,v)
+            buf += "\n"
+        buf += "----"
+        return buf
+
+class Experiment(BaseExperiment):
+    __slots__ = ("id", "obs", "dobs", "mutations")
+
     def __init__(self, id):
         self.id = id
         self.obs = {}
@@ -31,26 +61,148 @@ class Experiment:
         self.obs[t][node] = value
         self.dobs[t][node] = dvalue
 
-    def commit(self):
-        if len(self.obs) == 1:
-            warning("Experiment %d with clamping %s has only one data point (at time=%d)!"\
-                        % (self.id, self.mutations, list(self.obs.keys())[0]))
+class Observations(object):
+    """
+    Dense observations of a set of experiments: binarized (`values`) and
+    discretized (`dvalues`) observations indexed by experiment, time point
+    and node, with the mask `observed` of the values which are present
+    """
+    def __init__(self, eids, times, nodes):
+        self.eids = list(eids)
+        self.times = list(times)
+        self.nodes = list(nodes)
+        self.eindex = dict((e, i) for i, e in enumerate(self.eids))
+        self.tindex = dict((t, i) for i, t in enumerate(self.times))
+        self.nindex = dict((n, i) for i, n in enumerate(self.nodes))
+        shape = (len(self.eids), len(self.times), len(self.nodes))
+        self.values = np.zeros(shape, dtype=np.int8)
+        self.dvalues = np.zeros(shape, dtype=np.int32)
+        self.observed = np.zeros(shape, dtype=bool)
 
-    def __str__(self):
-        buf = "Experiment(%d):\n" % self.id
-        for a, c in sorted(self.mutations.items()):
-            buf += "\t%2d %s\n" % (c,a)
-        buf += "----\n"
-        for t, values in sorted(self.obs.items()):
-            buf += "\t%4d |" % t
-            for n, v in sorted(values.items()):
-                buf += "\t%s=%d" % (n,v)
-            buf += "\n"
-        buf += "----"
-        return buf
+    @classmethod
+    def from_experiments(celf, experiments):
+        times = set()
+        nodes = set()
+        for exp in experiments:
+            for t, values in exp.obs.items():
+                times.add(t)
+                nodes.update(values.keys())
+        store = celf([exp.id for exp in experiments], sorted(times),
+                        sorted(nodes))
+        for e, exp in enumerate(experiments):
+            for t, values in exp.obs.items():
+                dvalues = exp.dobs[t]
+                ti = store.tindex[t]
+                for node, value in values.items():
+                    n = store.nindex[node]
+                    store.values[e, ti, n] = value
+                    store.dvalues[e, ti, n] = dvalues[node]
+                    store.observed[e, ti, n] = True
+        return store
+
+    def __len__(self):
+        return int(self.observed.sum())
+
+    def entries(self):
+        """
+        Yields the (experiment id, time, node, value, dvalue) of the
+        observations
+        """
+        es, ts, ns = np.nonzero(self.observed)
+        values = self.values[es, ts, ns].tolist()
+        dvalues = self.dvalues[es, ts, ns].tolist()
+        for e, t, n, v, d in zip(es.tolist(), ts.tolist(), ns.tolist(),
+                                    values, dvalues):
+            yield self.eids[e], self.times[t], self.nodes[n], v, d
+
+class TimePointView(collections.MutableMapping):
+    """
+    dict node -> value of the observations of an experiment at a time point;
+    only the values of observed nodes can be changed
+    """
+    __slots__ = ("store", "array", "e", "t")
+
+    def __init__(self, store, array, e, t):
+        self.store = store
+        self.array = array
+        self.e = e
+        self.t = t
+
+    def _index(self, node):
+        n = self.store.nindex.get(node)
+        if n is None or not self.store.observed[self.e, self.t, n]:
+            raise KeyError(node)
+        return n
+
+    def __getitem__(self, node):
+        return int(self.array[self.e, self.t, self._index(node)])
+
+    def __setitem__(self, node, value):
+        self.array[self.e, self.t, self._index(node)] = value
+
+    def __delitem__(self, node):
+        raise TypeError("observations of a compact dataset cannot be removed")
+
+    def __iter__(self):
+        nodes = self.store.nodes
+        for n in np.nonzero(self.store.observed[self.e, self.t])[0].tolist():
+            yield nodes[n]
+
+    def __len__(self):
+        return int(self.store.observed[self.e, self.t].sum())
+
+class TimelineView(collections.Mapping):
+    """
+    dict time -> TimePointView of the observations of an experiment
+    """
+    __slots__ = ("store", "array", "e")
+
+    def __init__(self, store, array, e):
+        self.store = store
+        self.array = array
+        self.e = e
+
+    def _times(self):
+        return np.nonzero(self.store.observed[self.e].any(axis=1))[0].tolist()
+
+    def __getitem__(self, t):
+        ti = self.store.tindex.get(t)
+        if ti is None or not self.store.observed[self.e, ti].any():
+            raise KeyError(t)
+        return TimePointView(self.store, self.array, self.e, ti)
+
+    def __iter__(self):
+        times = self.store.times
+        for ti in self._times():
+            yield times[ti]
+
+    def __len__(self):
+        return len(self._times())
+
+class CompactExperiment(BaseExperiment):
+    """
+    Experiment whose observations are stored in an Observations instance;
+    obs and dobs are views on the store
+    """
+    __slots__ = ("id", "mutations", "store", "e")
+
+    def __init__(self, exp, store):
+        self.id = exp.id
+        self.mutations = exp.mutations
+        self.store = store
+        self.e = store.eindex[exp.id]
+
+    @property
+    def obs(self):
+        return TimelineView(self.store, self.store.values, self.e)
+
+    @property
+    def dobs(self):
+        return TimelineView(self.store, self.store.dvalues, self.e)
 
 class Dataset:
-    def __init__(self, name, dfactor=100, discretize="round", control_nodes=[]):
+    def __init__(self, name, dfactor=100, discretize="round", control_nodes=[],
+                    compact=False):
         self.name = name
         self.dfactor = dfactor
         self.discretize = getattr(self, "discretize_%s" % discretize)
@@ -60,10 +212,34 @@ class Dataset:
         self.readout = set()
         self.experiments = {}
         self.control_nodes = set(control_nodes)
+        self.compact = compact
+        self.store = None
+        self.warnings = []
+
+    def __getstate__(self):
+        # bound methods cannot be pickled
+        state = self.__dict__.copy()
+        state["discretize"] = self.discretize.__name__[len("discretize_"):]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.discretize = getattr(self, "discretize_%s" % state["discretize"])
 
     def discretize_round(self, value):
         return int(round(self.dfactor*value))
 
+    def discretize_round_array(self, values):
+        """
+        discretize_round over a float array, rounding half away from zero
+        like Python 2 round
+        """
+        scaled = self.dfactor*values
+        mag = np.abs(scaled)
+        rounded = np.floor(mag)
+        rounded += (mag - rounded) >= 0.5
+        return (np.sign(scaled)*rounded).astype(int)
+
     def binarize(self, dvalue):
         return 1 if dvalue >= self.dfactor/2 else 0
 
@@ -91,79 +267,173 @@ class Dataset:
         self.readout = set(self.setup.readouts)
         self.experiments = {}
 
+        nrows = len(df)
+
+        # clampings: one column of signs per clamped node, 0 if not clamped
+        cellline = [None]*nrows
+        clamp_nodes = []
+        clamp_signs = []
+        for col in df.columns:
+            if not col.startswith('TR'):
+                continue
+            values = df[col].values.astype(float)
+            missing = np.nonzero(np.isnan(values))[0]
+            if len(missing):
+                raise ValueError("MIDAS: no %s value at row %d" \
+                                    % (col, missing[0]+2))
+            values = values.astype(int)
+            if col.lower() == 'tr:cell:cellline':
+                cellline = values.tolist()
+                continue
+            var = col[3:]
+            if var in stimuli:
+                free = (values == 1).all() \
+                        or not len(graph.predecessors(var))
+                signs = np.where(values == 0, -1, values)
+                if not free:
+                    signs[values != 1] = 0
+            else:
+                var = var[:-1]
+                signs = np.where(values == 1, -1, 0)
+            clamp_nodes.append(var)
+            clamp_signs.append(signs)
+        if clamp_signs:
+            signatures = list(map(tuple, np.column_stack(clamp_signs).tolist()))
+        else:
+            signatures = [()]*nrows
+
+        # time of each row
+        da = df.filter(regex='^DA:').values.astype(float)
+        if np.isnan(da).any():
+            raise ValueError("cannot convert float NaN to integer")
+        da = da.astype(int)
+        if da.shape[1]:
+            bad = np.nonzero(da.min(axis=1) != da.max(axis=1))[0].tolist()
+        else:
+            bad = list(range(nrows))
+        assert not bad, "MIDAS: inconsistent DA values at row {}".format(bad[0]+2)
+        times = da[:,0].tolist() if nrows else []
+
+        # experiment of each row: the n-th row with a given clamping and
+        # time goes to the n-th experiment of this clamping
         exp_t = {}
         order = {}
-        def exp_of_clamps(cellline, clamps, time=None):
-            if time is not None:
-                key = (cellline, clamps, time)
-                if key not in order:
-                    order[key] = 1
-                else:
-                    order[key] += 1
-                key = (cellline, clamps, order[key])
-            else:
-                key = (cellline, clamps)
-            if key not in exp_t:
+        clamps_of = {}
+        row_exp = []
+        for cl, sig, time in zip(cellline, signatures, times):
+            key = (cl, sig, time)
+            order[key] = order.get(key, 0) + 1
+            key = (cl, sig, order[key])
+            exp = exp_t.get(key)
+            if exp is None:
+                if sig not in clamps_of:
+                    clamps_of[sig] = [(node, s) for node, s \
+                                        in zip(clamp_nodes, sig) if s]
                 eid = len(exp_t)
                 exp = Experiment(eid)
-                for node, clamp in clamps:
+                for node, clamp in clamps_of[sig]:
                     exp.add_mutation(node, clamp)
                 self.experiments[eid] = exp
                 exp_t[key] = exp
-                return exp
-            else:
-                return exp_t[key]
-
-        for i, row in df.iterrows():
-            clamps = set()
-            cellline = None
-            for var, sign in row.filter(regex='^TR').iteritems():
-                if var.lower() == 'tr:cell:cellline':
-                    cellline = int(sign)
-                    continue
-                var = var[3:]
-                sign = int(sign)
-                if var in stimuli:
-                    if sign == 1 or not len(graph.predecessors(var)):
-                        clamps.add((var, sign or -1))
-                elif sign == 1:
-                    clamps.add((var[:-1], -1))
-            clamps = tuple(clamps)
-
-            times = list(set(map(int,row.filter(regex='^DA:').values)))
-            assert len(times) == 1, "MIDAS: inconsistent DA values at row {}".format(i+2)
-            time = times[0]
-            exp = exp_of_clamps(cellline, clamps, time)
-
-            for var, fvalue in row.filter(regex='^DV').iteritems():
-                if np.isnan(fvalue):
-                    continue
-                var = var[3:]
-                time = int(row.get("DA:%s" % var, row.get("DA:ALL")))
-                dvalue = self.discretize(fvalue)
-                bvalue = self.binarize(dvalue)
-                exp.add_obs(time, var, bvalue, dvalue)
+            row_exp.append(exp)
+
+        # observations
+        dv_cols = [c for c in df.columns if is_readout(c)]
+        for col in dv_cols:
+            if "DA:%s" % col[3:] not in df.columns and "DA:ALL" not in df.columns \
+                    and df[col].notnull().any():
+                raise TypeError("MIDAS: no DA value for %s" % col)
+        dv = df[dv_cols].values.astype(float)
+        measured = ~np.isnan(dv)
+        dvalues = np.zeros(dv.shape, dtype=int)
+        discretize = getattr(self, "%s_array" % self.discretize.__name__)
+        dvalues[measured] = discretize(dv[measured])
+        bvalues = (dvalues >= self.dfactor/2).astype(int)
+        names = np.array([c[3:] for c in dv_cols], dtype=object)
+        for i in np.nonzero(measured.any(axis=1))[0].tolist():
+            cols = measured[i]
+            exp = row_exp[i]
+            time = times[i]
+            if time not in exp.obs:
+                exp.obs[time] = {}
+                exp.dobs[time] = {}
+            var = names[cols].tolist()
+            exp.obs[time].update(zip(var, bvalues[i, cols].tolist()))
+            exp.dobs[time].update(zip(var, dvalues[i, cols].tolist()))
 
         todel = []
         for exp in self.experiments.values():
-            exp.commit()
+            msg = exp.commit()
+            if msg:
+                self.warnings.append(msg)
             if len(exp.obs) == 1 and 0 in exp.obs:
                 todel.append(exp.id)
         for eid in todel:
             del self.experiments[eid]
 
+        if self.compact:
+            self.make_compact()
+
+    def load_from_store(self, setup, mutations, store, warnings=[]):
+        """
+        Sets the experiments from their mutations (dict id -> dict node ->
+        clamp) and the Observations store of their observations, as saved
+        from a dataset loaded with load_from_midas. The warnings of the
+        loading are repeated.
+        """
+        self.setup = setup
+        self.stimulus = set(self.setup.stimuli)
+        self.inhibitors = set(self.setup.inhibitors)
+        self.readout = set(self.setup.readouts)
+        self.experiments = {}
+        for msg in warnings:
+            warning(msg)
+        self.warnings = list(warnings)
+
+        for eid in store.eids:
+            exp = Experiment(eid)
+            for node, clamp in mutations[eid].items():
+                exp.add_mutation(node, clamp)
+            self.experiments[eid] = exp
+        if self.compact:
+            self.store = store
+            for eid in store.eids:
+                self.experiments[eid] = CompactExperiment(self.experiments[eid],
+                                                            store)
+        else:
+            for eid, t, node, value, dvalue in store.entries():
+                self.experiments[eid].add_obs(t, node, value, dvalue)
+
+    def make_compact(self):
+        """
+        Moves the observations of the experiments to a dense Observations
+        store, the experiments becoming CompactExperiment
+        """
+        experiments = sorted(self.experiments.values(), key=lambda e: e.id)
+        self.store = Observations.from_experiments(experiments)
+        for exp in experiments:
+            self.experiments[exp.id] = CompactExperiment(exp, self.store)
+
+    def observations(self):
+        """
+        Observations store of the dataset, built from the experiments if the
+        dataset is not compact
+        """
+        if self.store is not None:
+            return self.store
+        return Observations.from_experiments(sorted(self.experiments.values(),
+                                                key=lambda e: e.id))
+
 
     def to_funset(self):
         fs = funset(self.setup)
         clampings = []
         for exp in sorted(self.experiments.values(), key=lambda e: e.id):
-            i = exp.id
             literals = [Literal(node, sign) for node, sign in \
                             exp.mutations.items()]
             clampings.append(Clamping(literals))
-            for time, obs in exp.dobs.items():
-                for var, dval in obs.items():
-                    fs.add(gringo.Fun('obs', [i, time, var, dval]))
+        for i, time, var, _, dval in self.observations().entries():
+            fs.add(gringo.Fun('obs', [i, time, var, dval]))
         clampings = ClampingList(clampings)
         fs.update(clampings.to_funset("exp"))
         fs.update([gringo.Fun('control', [n]) for n in self.control_nodes])
@@ -175,3 +445,32 @@ class Dataset:
         buf += "\n".join(map(str, self.experiments.values()))
         return buf
 
+
+class SupportDomain(object):
+    """
+    Triples (experiment, time point, node index) for which the support of a
+    node by its formula is grounded (relevant/3 in supportConsistency.lp):
+    the node has hyperedges, it is neither clamped in the experiment nor a
+    control node, and the time point has a next one.
+    """
+    def __init__(self, hypergraph, dataset):
+        self.hypergraph = hypergraph
+        self.dataset = dataset
+
+    def triples(self):
+        nodes = self.hypergraph.nodes
+        targets = sorted(set(self.hypergraph.hyper.values))
+        for eid, exp in sorted(self.dataset.experiments.items()):
+            times = sorted(t for t, values in exp.obs.items() if len(values))
+            for i in targets:
+                name = nodes[i]
+                if name in exp.mutations or name in self.dataset.control_nodes:
+                    continue
+                for t in times[:-1]:
+                    yield eid, t, i
+
+    def to_funset(self):
+        fs = funset()
+        fs.update(gringo.Fun("relevant", list(triple)) \
+                    for triple in self.triples())
+        return fs
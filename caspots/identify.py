@@ -1,62 +1,109 @@
 
 from __future__ import print_function
 
-import math
+import itertools
+import multiprocessing
 import os
 from subprocess import *
 import sys
 import tempfile
 import time
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
 
 import gringo
-
-from caspo.core import LogicalNetwork
+import numpy as np
 
 from caspots.config import *
 from caspots import asputils
+from caspots.instrument import PROFILE
 from caspots.utils import *
 
-def crunch_data(answer, predicate, factor):
-    factor = float(factor)
-    data = {
-        "obs": {},
-        "bin": {}
-    }
-    keys = set()
-    for a in answer:
-        p = a.name()
-        if p in ["obs", predicate]:
-            args = a.args()
-            key = tuple(args[:3])
-            val = args[3]
-            if p == "obs":
-                val /= factor
-            t = "obs" if p == "obs" else "bin"
-            data[t][key] = val
-            keys.add(key)
-    return (keys, data)
-
-def MSE(cd):
-    cum = 0
-    keys, data = cd
-    n = 0
-    for key in keys:
-        if key not in data["obs"]:
-            continue
-        if key not in data["bin"]:
-            continue
-        n += 1
-        cum += (data["obs"][key] - data["bin"][key])**2
-    return math.sqrt(cum/n)
-
-def count_predicate(answer, predicate):
-    return len([a for a in answer if a.name() == predicate])
+class ObservedValues(object):
+    """
+    Observations of the dataset (obs facts), sorted by experiment, time point
+    and node as in Dataset.observations, against which the measured and
+    guessed values of samples are scored
+    """
+    def __init__(self, termset, factor):
+        obs = sorted(tuple(f.args()) for f in termset if f.name() == "obs")
+        self.keys = [key[:3] for key in obs]
+        self.index = dict((key, i) for i, key in enumerate(self.keys))
+        self.values = np.array([key[3] for key in obs], dtype=float) / factor
+        self.labels = {}
+        for d, name in enumerate(["experiment", "time", "node"]):
+            labels, codes = np.unique(np.array([key[d] for key in self.keys],
+                                        dtype=object), return_inverse=True)
+            self.labels[name] = (labels.tolist(), codes)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def breakdown(self, errors):
+        """
+        Sums and counts of the squared errors (NaN for unscored observations)
+        by experiment, time point and node: dict dimension -> dict label ->
+        (sum, count)
+        """
+        scored = ~np.isnan(errors)
+        result = {}
+        for name, (labels, codes) in self.labels.items():
+            sums = np.bincount(codes[scored], weights=errors[scored],
+                                minlength=len(labels))
+            counts = np.bincount(codes[scored], minlength=len(labels))
+            result[name] = dict((label, (float(sums[c]), int(counts[c]))) \
+                                for c, label in enumerate(labels) if counts[c])
+        return result
+
+def dnf_pairs(atoms):
+    """
+    (I,J) pairs of the dnf atoms, as an array of shape (n, 2)
+    """
+    return np.array([a.args() for a in atoms if a.name() == "dnf"],
+                        dtype=np.int32).reshape(-1, 2)
 
 class ASPSample:
-    def __init__(self, opts, model):
+    def __init__(self, opts, model, observed):
         self.opts = opts
-        self.atoms = model.atoms()
         self.optimization = model.optimization()
+        self.observed = observed
+        self.guessed = {}
+        index = observed.index
+        dnf = []
+        # formula and clause atoms, for the exclusion of the network
+        self.atoms = []
+        scored = ([], [], [])
+        for a in model.atoms():
+            p = a.name()
+            if p == "dnf":
+                dnf.append(a.args())
+            elif p == "formula" or p == "clause":
+                self.atoms.append(a)
+            elif p == "guessed" or p == "measured":
+                args = a.args()
+                key = tuple(args[:3])
+                if p == "guessed":
+                    self.guessed[key] = args[3]
+                i = index.get(key)
+                if i is not None:
+                    scored[0].append(p == "guessed")
+                    scored[1].append(i)
+                    scored[2].append(args[3])
+        self.dnf = np.array(dnf, dtype=np.int32).reshape(-1, 2)
+        # measured (row 0) and guessed (row 1) values of the observations
+        self.estimates = np.full((2, len(observed)), np.nan)
+        self.estimates[np.array(scored[0], dtype=int),
+                        np.array(scored[1], dtype=int)] = scored[2]
+        self.trace_rejected = False
+
+    def reject_trace(self):
+        """
+        With --enum-traces, asks for another trace of the same network
+        (see ASPSolver.solution_samples)
+        """
+        self.trace_rejected = True
 
     def weight(self):
         return self.optimization[0]
@@ -64,49 +111,97 @@ class ASPSample:
     def size(self):
         return self.optimization[1] if len(self.optimization) > 1 else None
 
-    def asp_exclusion(self):
-        predicates = ["formula", "dnf", "clause"]
-        if self.opts.enum_traces:
-            predicates += ["guessed"]
-        clauses = [a for a in self.atoms if a.name() in predicates]
+    def exclusion_atoms(self, k):
+        """
+        Externals of the k-th exclusion slot giving the formula, dnf and
+        clause atoms of the sample (see exclusion.lp)
+        """
+        atoms = [gringo.Fun("excluded_%s" % a.name(), [k] + a.args()) \
+                    for a in self.atoms]
+        atoms += [gringo.Fun("excluded_dnf", [k, i, j]) \
+                    for i, j in self.dnf.tolist()]
+        return atoms
+
+    def asp_exclusion(self, trace=False):
+        clauses = map(str, self.atoms)
+        clauses += ["dnf(%d,%d)" % (i, j) for i, j in self.dnf]
+        if trace:
+            clauses += [str(gringo.Fun("guessed", list(key) + [val])) \
+                            for key, val in sorted(self.guessed.items())]
         if self.opts.family == "all":
-            nb_formula = count_predicate(self.atoms, "formula")
-            nb_dnf = count_predicate(self.atoms, "dnf")
-            nb_clause = count_predicate(self.atoms, "clause")
+            nb_formula = len([a for a in self.atoms if a.name() == "formula"])
+            nb_dnf = len(self.dnf)
+            nb_clause = len([a for a in self.atoms if a.name() == "clause"])
             clauses += [
                 "%d{formula(V,I): node(V,I)}%d" % (nb_formula, nb_formula),
                 "%d{dnf(I,J): hyper(I,J,N)}%d" % (nb_dnf, nb_dnf),
                 "%d{clause(J,V,B): edge(J,V,B)}%d" % (nb_clause, nb_clause)
             ]
-        return ":- %s." % ", ".join(map(str, clauses))
+        return ":- %s." % (", ".join(clauses) or "#true")
 
-    def mse(self):
-        cd_measured = crunch_data(self.atoms, "measured", self.opts.factor)
-        cd_guessed = crunch_data(self.atoms, "guessed", self.opts.factor)
-        mse0 = MSE(cd_measured)
-        mse = MSE(cd_guessed)
-        return (mse0, mse)
+    def squared_errors(self):
+        """
+        Squared errors of the measured (row 0) and guessed (row 1) values,
+        NaN for the observations without such values
+        """
+        return (self.observed.values - self.estimates)**2
 
-    def network(self, hypergraph):
-        tuples = (f.args() for f in self.atoms if f.name() == "dnf")
-        return LogicalNetwork.from_hypertuples(hypergraph, tuples)
+    def mse(self):
+        """
+        MSE of the measured (discrete) and of the guessed values; raises
+        ZeroDivisionError when no observation has such values
+        """
+        errors = self.squared_errors()
+        counts = np.sum(~np.isnan(errors), axis=1)
+        if not counts.all():
+            raise ZeroDivisionError("MSE: no measured or guessed value "
+                                    "of the observations")
+        mse0, mse = np.sqrt(np.nansum(errors, axis=1) / counts)
+        return (float(mse0), float(mse))
+
+    def residuals(self, guessed=True):
+        """
+        Breakdown of the squared errors of the guessed (or measured) values
+        by experiment, time point and node (see ObservedValues.breakdown)
+        """
+        return self.observed.breakdown(self.squared_errors()[int(guessed)])
+
+    def network(self, decoder):
+        return decoder.network(decoder.positions(self.dnf))
 
     def trace(self, dataset):
         # rewrite dataset using guessed predicate
-        for a in self.atoms:
-            if a.name() == "guessed":
-                eid, t, node, value = a.args()
-                if node not in dataset.readout:
-                    continue
-                if node in dataset.control_nodes:
-                    continue
-                if node not in dataset.experiments[eid].obs[t]:
-                    continue
-                if dataset.experiments[eid].obs[t][node] != value:
-                    #print(((eid,t,node),dataset.experiments[eid].obs[t][node], value), file=sys.stderr)
-                    dataset.experiments[eid].obs[t][node] = value
+        for (eid, t, node), value in self.guessed.items():
+            if node not in dataset.readout:
+                continue
+            if node in dataset.control_nodes:
+                continue
+            if node not in dataset.experiments[eid].obs[t]:
+                continue
+            if dataset.experiments[eid].obs[t][node] != value:
+                dataset.experiments[eid].obs[t][node] = value
         return dataset
 
+class PartialModel(object):
+    """
+    Model enumerated in another process, restricted to its dnf atoms
+    """
+    def __init__(self, dnf):
+        self.dnf = dnf
+
+    def atoms(self):
+        return [gringo.Fun("dnf", list(pair)) for pair in self.dnf]
+
+_cube_state = None
+
+def _init_cube_worker(solver, setup):
+    global _cube_state
+    _cube_state = (solver, setup)
+
+def _enumerate_cube(cube):
+    solver, setup = _cube_state
+    return solver.enumerate_cube(cube, *setup)
+
 def print_conf(conf, prefix=""):
     for k in conf.keys():
         v = getattr(conf, k)
@@ -115,14 +210,32 @@ def print_conf(conf, prefix=""):
         else:
             dbg("# conf %s%s = %s" % (prefix, k, v))
 
+# configurations raced for the initial optimization (see --portfolio);
+# the first one is the default configuration
+PORTFOLIO = [
+    ["--conf=trendy", "--opt-strat=usc"],
+    ["--conf=crafty", "--opt-strat=bb"],
+    ["--conf=jumpy", "--opt-strat=usc"],
+    ["--conf=trendy", "--opt-strat=bb"],
+    ["--conf=handy", "--opt-strat=usc"],
+    ["--conf=crafty", "--opt-strat=usc", "--heuristic=Vsids"],
+    ["--conf=jumpy", "--opt-strat=bb", "--heuristic=Berkmin"],
+    ["--conf=tweety", "--opt-strat=bb"],
+]
+
 class ASPSolver:
+    # number of exclusion slots grounded at once (see exclude)
+    exclusion_block = 128
+
     def __init__(self, termset, opts, domain=None, restrict=None,
-                        fixpoints=False, nodataset=False):
+                        fixpoints=False, nodataset=False, ground_cache=None):
         self.termset = termset
+        self.observed = ObservedValues(termset, float(opts.factor))
         self.data = termset.to_str()
         self.opts = opts
         self.debug = opts.debug
         self.nodataset = nodataset
+        self.ground_cache = ground_cache
         if domain is None:
             self.domain = [aspf("guessBN.lp")]
             if opts.fully_controllable:
@@ -134,15 +247,22 @@ class ASPSolver:
         if fixpoints:
             self.domain.append(aspf("fixpoints.lp"))
 
-    def default_control(self, *args):
-        control = gringo.Control(["--conf=trendy", "--stats",
-                            "--opt-strat=usc"] + list(args))
-        for f in self.domain:
-            control.load(f)
+    def default_control(self, *args, **kwargs):
+        conf = kwargs.get("conf", PORTFOLIO[0])
+        control = gringo.Control(conf + ["--stats"] + list(args))
+        files = list(self.domain)
         if not self.nodataset:
-            control.load(aspf("supportConsistency.lp"))
-            control.load(aspf("normalize.lp"))
-        control.add("base", [], self.data)
+            files += [aspf("supportConsistency.lp"), aspf("normalize.lp")]
+        program = None
+        if self.ground_cache is not None:
+            program = self.ground_cache.program(files, self.data)
+        if program is None:
+            for f in files:
+                control.load(f)
+            control.add("base", [], self.data)
+        else:
+            # the base program is then already ground
+            control.load(program)
 
         if self.opts.clingo_parallel_mode:
             control.conf.solve.parallel_mode = self.opts.clingo_parallel_mode
@@ -154,10 +274,11 @@ class ASPSolver:
             #control.conf.solve.opt_mode = "opt"
             self.setup_opt(control)
 
-            control.ground([("base", [])])
+            with PROFILE.phase("grounding"):
+                control.ground([("base", [])])
 
-            control.load(aspf("show.lp"))
-            control.ground([("show", [])])
+                control.load(aspf("show.lp"))
+                control.ground([("show", [])])
             control.assign_external(gringo.Fun("tolerance"),False)
 
         else:
@@ -169,30 +290,101 @@ class ASPSolver:
             control.conf.solve.models = 1
 
         models = []
-        res = control.solve(None, lambda model: models.append(ASPSample(self.opts, model)))
+        with PROFILE.phase("optimization") if first else PROFILE.timed("sample"):
+            res = control.solve(None, lambda model: models.append(ASPSample(self.opts, model, self.observed)))
+        if first:
+            PROFILE.solver("optimization", control)
         if models:
             model = models.pop()
             return model
 
     def solution_samples(self):
+        """
+        Yields samples of distinct networks. With --enum-traces, when the
+        trace of a sample is rejected (see ASPSample.reject_trace), other
+        traces of the same network are looked for, up to --max-traces traces
+        per network.
+        """
         control = self.default_control()
         weight = None
         size = None
         i = 0
+        excluded = 0
+        tracing = None
         while True:
             s = self.sample(control, i == 0, weight=weight, minsize=size)
-            if s:
-                i += 1
-                yield s
-                if i == 1:
-                    weight = s.weight()
-                    size = s.size()
-                    dbg("# first sample weight = %s, size = %s" % (weight, size))
-                control.add("excl", [], s.asp_exclusion())
-                control.ground([("excl", [])])
-            else:
+            # the weight and size constraints are only grounded once
+            weight = size = None
+            if s is None and tracing is not None:
+                # no other trace for this network
+                control.assign_external(tracing, False)
+                tracing = None
+                continue
+            if s is None:
                 print("# Enumeration complete")
                 break
+            i += 1
+            traces = 1 if tracing is None else traces + 1
+            yield s
+            if i == 1:
+                weight = s.weight()
+                size = s.size()
+                dbg("# first sample weight = %s, size = %s" % (weight, size))
+            if self.opts.enum_traces and s.trace_rejected \
+                    and traces < self.opts.max_traces:
+                if tracing is None:
+                    tracing = self.fix_network(control, s, i)
+                self.exclude_trace(control, s, i)
+            else:
+                if tracing is not None:
+                    control.assign_external(tracing, False)
+                    tracing = None
+                self.exclude(control, s, excluded)
+                excluded += 1
+
+    def exclude(self, control, sample, k):
+        """
+        Excludes the network of a sample with the k-th exclusion slot (see
+        exclusion.lp), by assigning its externals. The slots are grounded
+        by blocks of `exclusion_block`, so that excluding a sample does not
+        ground anything in general.
+        """
+        if k % self.exclusion_block == 0:
+            if k == 0:
+                control.load(aspf("exclusion.lp"))
+            parts = ["exclusion"]
+            if self.opts.family == "all":
+                parts.append("exclusion_all")
+            control.ground([(part, [j]) for j in \
+                    range(k, k + self.exclusion_block) for part in parts])
+        for atom in sample.exclusion_atoms(k):
+            control.assign_external(atom, True)
+        control.assign_external(gringo.Fun("exclude", [k]), True)
+
+    def exclude_trace(self, control, sample, i):
+        """
+        Excludes the trace of the i-th sample, in a program part of its own
+        """
+        prg = "excl%d" % i
+        control.add(prg, [], sample.asp_exclusion(trace=True))
+        control.ground([(prg, [])])
+
+    def fix_network(self, control, sample, i):
+        """
+        Restricts the next samples to the network of the i-th sample, until
+        the returned external atom is released
+        """
+        prg = "fix%d" % i
+        tracing = gringo.Fun("tracing", [i])
+        rules = ["#external %s." % tracing]
+        rules += [":- %s, not dnf(%d,%d)." % (tracing, a, b) \
+                    for a, b in sample.dnf]
+        rules.append(":- %s, %d{dnf(I,J): hyper(I,J,N)}." \
+                    % (tracing, len(sample.dnf)+1))
+        control.add(prg, [], "\n".join(rules))
+        control.ground([(prg, [])])
+        control.assign_external(tracing, True)
+        return tracing
 
     def setup_opt(self, control):
         control.load(aspf("minimizeWeightOnly.lp"))
@@ -218,20 +410,221 @@ class ASPSolver:
         return  self.opts.family == "mincard" \
             or self.opts.force_size is not None
 
+    def optimum(self, conf=PORTFOLIO[0]):
+        """
+        Returns the optimizations of an optimal model found with the given
+        clingo configuration.
+        """
+        control = self.default_control("0", conf=conf)
+        self.setup_opt(control)
+        control.ground([("base", [])])
+        control.load(aspf("show.lp"))
+        control.ground([("show", [])])
+        control.assign_external(gringo.Fun("tolerance"),False)
+        opt = []
+        control.solve(None, lambda model: opt.append(model.optimization()))
+        return opt.pop()
+
+    def race_optimum(self, confs):
+        """
+        Computes the optimum with each of the configurations `confs` in a
+        separate process; the first proven optimum is returned and the
+        other processes are terminated. RuntimeError is raised if all the
+        processes exited (e.g. killed) without a result.
+        """
+        results = multiprocessing.Queue()
+        def run(conf):
+            try:
+                results.put((conf, self.optimum(conf)))
+            except Exception as e:
+                results.put((conf, e))
+        procs = [multiprocessing.Process(target=run, args=(conf,))
+                    for conf in confs]
+        try:
+            for p in procs:
+                p.daemon = True
+                p.start()
+            for _ in procs:
+                while True:
+                    try:
+                        conf, res = results.get(timeout=1)
+                        break
+                    except Empty:
+                        # the results of exited processes are already queued
+                        if not any(p.is_alive() for p in procs) \
+                                and results.empty():
+                            raise RuntimeError("portfolio: no result, "
+                                "exit codes %s" % [p.exitcode for p in procs])
+                if not isinstance(res, Exception):
+                    dbg("# portfolio won by %s" % " ".join(conf))
+                    return res
+                dbg("# portfolio %s failed: %s" % (" ".join(conf), res))
+            raise res
+        finally:
+            for p in procs:
+                if p.is_alive():
+                    p.terminate()
+                p.join()
+
+    def solve_refined(self, control, on_model, learned, limit=0):
+        """
+        Enumerates the models, restarting the search whenever constraints
+        have been added to the set `learned` (e.g. by on_model); the models
+        already enumerated are then excluded.
+        """
+        nb = 0
+        rounds = 0
+        excluded = []
+        while True:
+            with control.solve_iter() as models:
+                for model in models:
+                    dnfs = ["dnf(%d,%d)" % (i, j) \
+                                for i, j in dnf_pairs(model.atoms())]
+                    on_model(model)
+                    excluded.append(":- %s." % ", ".join(dnfs + \
+                        ["%d{dnf(I,J): hyper(I,J,N)}%d" % (len(dnfs), len(dnfs))]))
+                    nb += 1
+                    if limit and nb >= limit:
+                        return
+                    if learned:
+                        break
+                else:
+                    return
+            rounds += 1
+            dbg("# refinement %d: %d learned constraint(s)" % (rounds, len(learned)))
+            prg = "refine%d" % rounds
+            control.add(prg, [], "\n".join(excluded + sorted(learned)))
+            control.ground([(prg, [])])
+            learned.clear()
+            excluded = []
+
+    def setup_enumeration(self, control, weight, minsize, do_subsets, limit):
+        self.setup_weight(control, weight)
+        self.setup_card(control, minsize)
+
+        control.conf.solve.opt_mode = "ignore"
+        control.conf.solve.project = 1 # ????
+        control.conf.solve.models = limit # ????
+        #print control.conf.solver[0].keys()
+        if do_subsets:
+            control.conf.solve.enum_mode = "domRec"
+            control.conf.solver[0].heuristic = "Domain"
+            control.conf.solver[0].dom_mod = "5,16"
+
+    def split_atoms(self, k):
+        """
+        Chooses k dnf(I,J) atoms to split the search space: one per node,
+        from the nodes having the most hyperedges, with the shortest clause
+        """
+        hyper = {}
+        for f in self.termset:
+            if f.name() == "hyper":
+                i, j, n = f.args()
+                hyper.setdefault(i, []).append((n, j))
+        nodes = sorted(hyper, key=lambda i: (-len(hyper[i]), i))
+        return [(i, min(hyper[i])[1]) for i in nodes[:k]]
+
+    def cubes(self, k):
+        """
+        Disjoint cubes covering the search space, as lists of (atom, value)
+        """
+        atoms = self.split_atoms(k)
+        dbg("# split over %s" % " ".join(["dnf(%d,%d)" % a for a in atoms]))
+        for values in itertools.product([True, False], repeat=len(atoms)):
+            yield list(zip(atoms, values))
+
+    def enumerate_cube(self, cube, weight, minsize, do_subsets, limit):
+        """
+        Returns the dnf atoms of the solutions within the cube, which are
+        subset-minimal within the cube only
+        """
+        control = self.default_control("0")
+        self.setup_opt(control)
+        control.ground([("base", [])])
+        control.load(aspf("show.lp"))
+        control.ground([("show", [])])
+        control.assign_external(gringo.Fun("tolerance"),True)
+        self.setup_enumeration(control, weight, minsize, do_subsets,
+                                0 if do_subsets else limit)
+        control.add("cube", [], "\n".join([":- %sdnf(%d,%d)." \
+                % ("not " if value else "", i, j) for (i, j), value in cube]))
+        control.ground([("cube", [])])
+        found = []
+        control.solve(None, lambda model: found.append(
+            frozenset(map(tuple, dnf_pairs(model.atoms()).tolist()))))
+        return found
+
+    def solve_split(self, on_model, setup):
+        """
+        Enumerates the solutions of each cube in a separate process, at most
+        one cube per process being scheduled at once. The cubes are merged
+        in the order of their number of true atoms, so that a strict subset
+        of a solution can only be in a cube merged before it: the solutions
+        which are subset-minimal within their cube only are discarded when
+        merging. Once `limit` solutions are merged, the remaining cubes are
+        not scheduled. The merged solutions are sorted, so that the output
+        does not depend on the scheduling of the processes.
+        """
+        weight, minsize, do_subsets, limit = setup
+        jobs = self.opts.split_jobs or multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(jobs, _init_cube_worker, (self, setup))
+        # cubes(k) yields the cube with all the atoms true first
+        cubes = iter(list(self.cubes(self.opts.split))[::-1])
+        pending = []
+        solutions = []
+        discarded = 0
+        try:
+            while not limit or len(solutions) < limit:
+                for cube in itertools.islice(cubes, jobs - len(pending)):
+                    pending.append(pool.apply_async(_enumerate_cube, (cube,)))
+                if not pending:
+                    break
+                # the order of the solutions within a cube depends on the solver
+                for sol in sorted(pending.pop(0).get(), key=sorted):
+                    if do_subsets and any(s < sol for s in solutions):
+                        discarded += 1
+                    else:
+                        solutions.append(sol)
+            if pending:
+                pool.terminate()
+            else:
+                pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        if do_subsets:
+            dbg("# %d non-minimal solution(s) discarded" % discarded)
+        if limit:
+            solutions = solutions[:limit]
+        solutions.sort(key=sorted)
+        for dnf in solutions:
+            on_model(PartialModel(sorted(dnf)))
+
     def solutions(self, on_model, on_model_weight=None, limit=0,
-                    force_weight=None):
+                    force_weight=None, learned=None):
+        """
+        Enumerates the solutions. If `learned` is a set, the constraints
+        added to it by on_model are used to prune the remaining search
+        (see solve_refined); this is only supported when the solutions are
+        not subset-minimal.
+        """
 
         control = self.default_control("0")
 
         do_subsets = self.opts.family == "subset" \
             or (self.opts.family =="mincard" and self.opts.mincard_tolerance)
+        assert learned is None or not do_subsets, \
+            "learned constraints would change subset-minimality"
         minsize = None
 
         self.setup_opt(control)
-        control.ground([("base", [])])
+        with PROFILE.phase("grounding"):
+            control.ground([("base", [])])
 
-        control.load(aspf("show.lp"))
-        control.ground([("show", [])])
+            control.load(aspf("show.lp"))
+            control.ground([("show", [])])
 
         start = time.time()
 
@@ -239,13 +632,20 @@ class ASPSolver:
             force_weight = 0
 
         if force_weight is None:
-            control.assign_external(gringo.Fun("tolerance"),False)
             dbg("# start initial solving")
-            opt = []
-            res = control.solve(None, lambda model: opt.append(model.optimization()))
+            if self.opts.portfolio > 1:
+                with PROFILE.phase("optimization"):
+                    optimizations = self.race_optimum(
+                                        PORTFOLIO[:self.opts.portfolio])
+            else:
+                control.assign_external(gringo.Fun("tolerance"),False)
+                opt = []
+                with PROFILE.phase("optimization"):
+                    res = control.solve(None, lambda model: opt.append(model.optimization()))
+                PROFILE.solver("optimization", control)
+                optimizations = opt.pop()
             dbg("# initial solve took %s" % (time.time()-start))
 
-            optimizations = opt.pop()
             dbg("# optimizations = %s" % optimizations)
 
             weight = optimizations[0]
@@ -263,21 +663,24 @@ class ASPSolver:
             control.assign_external(gringo.Fun("tolerance"),True)
             dbg("# force weight = %d" % weight)
 
-        self.setup_weight(control, weight)
-        self.setup_card(control, minsize)
+        if self.opts.split and learned is None:
+            start = time.time()
+            with PROFILE.phase("enumeration"):
+                self.solve_split(on_model, (weight, minsize, do_subsets, limit))
+            dbg("# enumeration took %s" % (time.time()-start))
+            return
 
-        control.conf.solve.opt_mode = "ignore"
-        control.conf.solve.project = 1 # ????
-        control.conf.solve.models = limit # ????
-        #print control.conf.solver[0].keys()
-        if do_subsets:
-            control.conf.solve.enum_mode = "domRec"
-            control.conf.solver[0].heuristic = "Domain"
-            control.conf.solver[0].dom_mod = "5,16"
+        self.setup_enumeration(control, weight, minsize, do_subsets, limit)
 
         start = time.time()
         dbg("# begin enumeration")
-        res = control.solve(None, on_model)
+        with PROFILE.phase("enumeration"):
+            if learned is None:
+                res = control.solve(None, on_model)
+            else:
+                control.conf.solve.models = 0
+                self.solve_refined(control, on_model, learned, limit)
+        PROFILE.solver("enumeration", control)
         dbg("# enumeration took %s" % (time.time()-start))
 
 
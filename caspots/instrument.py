@@ -0,0 +1,127 @@
+"""
+Timeline of the pipeline, latency histograms and clingo statistics, written
+as JSON with --profile-json
+"""
+from contextlib import contextmanager
+import json
+import math
+import resource
+import threading
+import time
+
+import multiprocessing
+
+def flatten(stats, prefix=""):
+    """
+    Yields the (dotted key, value) pairs of nested statistics
+    """
+    for k, v in stats.items():
+        key = "%s%s" % (prefix, k)
+        if isinstance(v, dict):
+            for kv in flatten(v, "%s." % key):
+                yield kv
+        else:
+            yield key, v
+
+SUMMARY_STATS = ["choices", "conflicts", "rules", "atoms"]
+
+class Profile(object):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # latencies may be merged by the result handler of a pool
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.phases = []
+        self.histograms = {}
+        self.clingo = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append({"phase": name,
+                                "start": start - self.start,
+                                "duration": time.time() - start})
+
+    @contextmanager
+    def timed(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.latency(name, time.time() - start)
+
+    def latency(self, name, duration):
+        """
+        Records a duration (in seconds) in the histogram `name`, with
+        power-of-two buckets in milliseconds
+        """
+        bucket = 2**max(0, int(math.ceil(math.log(max(duration*1000, 1), 2))))
+        with self.lock:
+            hist = self.histograms.setdefault(name, {})
+            hist[bucket] = hist.get(bucket, 0) + 1
+
+    def solver(self, name, control):
+        """
+        Records the statistics of the last solve call of `control`
+        """
+        stats = control.stats
+        summary = dict((k, v) for k, v in flatten(stats) \
+                        if k.split(".")[-1] in SUMMARY_STATS)
+        self.clingo.append({"phase": name, "summary": summary,
+                            "statistics": stats})
+
+    def merge(self, histograms):
+        with self.lock:
+            for name, hist in histograms.items():
+                mine = self.histograms.setdefault(name, {})
+                for bucket, count in hist.items():
+                    mine[bucket] = mine.get(bucket, 0) + count
+
+    def take(self):
+        """
+        Returns the latencies recorded since the last call, and forgets them
+        """
+        with self.lock:
+            histograms, self.histograms = self.histograms, {}
+        return histograms
+
+    def to_dict(self):
+        histograms = {}
+        for name, hist in self.histograms.items():
+            histograms[name] = {
+                "count": sum(hist.values()),
+                "buckets_ms": [[b, hist[b]] for b in sorted(hist)],
+            }
+        return {
+            "duration": time.time() - self.start,
+            "phases": self.phases,
+            "latency": histograms,
+            "clingo": self.clingo,
+            # in kilobytes
+            "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "peak_rss_children":
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        }
+
+    def write(self, filename):
+        with open(filename, "w") as fd:
+            json.dump(self.to_dict(), fd, indent=1, sort_keys=True)
+
+PROFILE = Profile()
+
+def worker_profile():
+    """
+    Starts a new profile in a worker process, without the latencies of the
+    main process it was forked from. The latencies of the worker are sent
+    back with the result of each task (see Profile.take) and merged by the
+    main process, so that they are kept when the pool is terminated.
+    Does nothing in the main process.
+    """
+    if multiprocessing.current_process().name == "MainProcess":
+        return
+    PROFILE.reset()
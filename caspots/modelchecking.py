@@ -1,6 +1,18 @@
 #!/usr/bin/env python
 
+import errno
+import fcntl
+import os
+import re
+import shutil
 import subprocess
+import tempfile
+import time
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 from .utils import *
 
@@ -9,15 +21,71 @@ U_ASYNC = "asynchronous"
 
 MODES = [U_GENERAL, U_ASYNC]
 
-def make_smv(dataset, network, destfile, update=U_GENERAL):
+# encodings of the possible orders of changes of control nodes
+CTL_COUNTERS = "counters"
+CTL_INTERLEAVINGS = "interleavings"
+
+CTL_ENCODINGS = [CTL_COUNTERS, CTL_INTERLEAVINGS]
+
+def make_smv(dataset, network, destfile, update=U_GENERAL,
+                encoding=CTL_COUNTERS):
+    with open(destfile, "w") as smv:
+        write_smv(smv, dataset, network, update, encoding=encoding)
+    return destfile
 
+def control_toggles(dataset):
+    """
+    Returns the maximum number of changes of each control node along the
+    time series of an experiment
+    """
+    toggles = dict((n, 0) for n in dataset.control_nodes)
+    for exp in dataset.experiments.values():
+        states = [exp.obs[t] for t in sorted(exp.obs)]
+        for n in toggles:
+            nb = len([1 for a, b in zip(states, states[1:]) \
+                        if n in a and n in b and a[n] != b[n]])
+            toggles[n] = max(toggles[n], nb)
+    return toggles
+
+def write_smv(smv, dataset, network, update=U_GENERAL, exp_ids=None,
+                encoding=CTL_COUNTERS):
+    """
+    Writes the SMV model of the network with one named CTL specification
+    E<id>_SPEC per experiment, for the experiments `exp_ids` (default: all)
+    in the given order.
+
+    With the CTL_COUNTERS encoding, each control node n has a counter
+    toggles_n of its changes, saturating at a value which is never
+    expected; between two time points, the counters of changing control
+    nodes may be incremented once and the others are constant. This
+    expresses with one until operator all the orders of changes which are
+    enumerated by the CTL_INTERLEAVINGS encoding.
+    """
+
+    return write_batch_smv(smv, dataset, [network], update, exp_ids, encoding)
+
+def write_batch_smv(smv, dataset, networks, update=U_GENERAL, exp_ids=None,
+                        encoding=CTL_COUNTERS):
+    """
+    Writes the SMV model of several networks defining formulas for the same
+    nodes: the frozen variable `net` selects the formulas of the network of
+    given index. The specifications are then true iff they are true for
+    all the networks.
+
+    Returns the CTL formula of each experiment.
+    """
     # nodes referenced in dataset
-    dvars = dataset.setup.nodes.union(network.variables())
+    dvars = set(dataset.setup.nodes)
+    for network in networks:
+        dvars.update(network.variables())
 
     control_nodes = dataset.control_nodes
 
     # nodes for which a function is defined
-    varying_nodes = set([node for node, _ in network.formulas_iter()])
+    formulas = [dict(network.formulas_iter()) for network in networks]
+    varying_nodes = set(formulas[0])
+    assert all([set(f) == varying_nodes for f in formulas]), \
+        "Networks of a batch should define formulas for the same nodes"
     varying_nodes.update(control_nodes)
 
     # nodes with no function (i.e., constant value)
@@ -36,8 +104,15 @@ def make_smv(dataset, network, destfile, update=U_GENERAL):
     clampable = varying_nodes.intersection(dataset.inhibitors.union(dataset.stimulus))
     assert not control_nodes.intersection(clampable), "Control nodes should not be declared as TR!"
 
-    smv = open(destfile, "w")
+    if encoding == CTL_COUNTERS:
+        max_toggles = dict((n, k+1) for n, k in control_toggles(dataset).items())
+    else:
+        max_toggles = {}
+
     smv.write("MODULE main\n")
+    if len(networks) > 1:
+        smv.write("\nFROZENVAR\n")
+        smv.write("\tnet: 0..%d;\n" % (len(networks)-1))
     smv.write("\nVAR\n")
     smv.write("\tstart: boolean;\n")
     for n in constants:
@@ -49,9 +124,15 @@ def make_smv(dataset, network, destfile, update=U_GENERAL):
             smv.write("\tC_%s: {0,1,-1};\n" % n)
     for n in dirty_start:
         smv.write("\tdirty_%s: boolean;\n" % n)
+    for n, k in max_toggles.items():
+        smv.write("\ttoggles_%s: 0..%d;\n" % (n, k))
 
     smv.write("\nASSIGN\n")
     smv.write("next(start) := FALSE;\n")
+    for n, k in max_toggles.items():
+        smv.write("init(toggles_%s) := 0;\n" % n)
+        smv.write("next(toggles_{0}) := case next(n_{0}) != n_{0} & toggles_{0} < {1}: "\
+                    "toggles_{0} + 1; TRUE: toggles_{0}; esac;\n".format(n, k))
     for n in dirty_start:
         smv.write("next(dirty_%s) := FALSE;\n" % n)
     for n in constants:
@@ -83,10 +164,22 @@ def make_smv(dataset, network, destfile, update=U_GENERAL):
             return "FALSE"
         return " | ".join(map(nusmv_of_clause, clauses))
 
-    for n, clauses in network.formulas_iter():
+    def nusmv_of_formulas(n):
+        exprs = {}
+        for i, f in enumerate(formulas):
+            exprs.setdefault(nusmv_of_clauses(f[n]), []).append(i)
+        if len(exprs) == 1:
+            return list(exprs)[0]
+        cases = sorted(exprs.items(), key=lambda e: e[1])
+        expr = "case "
+        for e, nets in cases[:-1]:
+            expr += "net in {%s}: %s; " % (", ".join(map(str, nets)), e)
+        return expr + "TRUE: %s; esac" % cases[-1][0]
+
+    for n in sorted(varying_nodes):
         if n in control_nodes:
             continue
-        expr = nusmv_of_clauses(clauses)
+        expr = nusmv_of_formulas(n)
         if n in clampable:
             smv.write("F_%s := case C_%s=0: %s; " % (n, n, expr))
             smv.write("C_%s=1: TRUE; C_%s=-1: FALSE; esac;\n" % (n, n))
@@ -123,7 +216,7 @@ def make_smv(dataset, network, destfile, update=U_GENERAL):
             smv.write("E%d_T%d := %s;\n" % (exp.id, t, " & ".join(state)))
 
     fpconds = ["n_%s = F_%s" % (n, n) for n in varying_nodes]
-    smv.write("FIXEDPOINTS := %s;\n" % " & ".join(fpconds))
+    smv.write("FIXEDPOINTS := %s;\n" % (" & ".join(fpconds) or "TRUE"))
 
     smv.write("\nTRANS\n")
     smv.write("  next(start) != start")
@@ -133,7 +226,7 @@ def make_smv(dataset, network, destfile, update=U_GENERAL):
     smv.write("\n| FIXEDPOINTS")
     smv.write(";\n")
 
-    if update == U_ASYNC:
+    if update == U_ASYNC and len(varying_nodes) > 1:
         for n in varying_nodes:
             cond = " & ".join(["!u_%s" % m for m in varying_nodes if m != n])
             smv.write("TRANS u_%s -> %s;\n" % (n, cond))
@@ -153,18 +246,19 @@ def make_smv(dataset, network, destfile, update=U_GENERAL):
         def control_state(t):
             return dict([(n,v) for (n,v) in exp.obs[t].items() if n in control_nodes])
 
-        def ctl_of_timeseries(t, ts):
+        def ctl_of_timeseries(t, ts, toggles):
             if not ts:
                 return "TRUE"
 
             ctl_t = "E{exp}_T{t}".format(exp=exp.id, t=ts[0])
-            if len(ts) == 1:
-                next_ctl = ctl_t
-            else:
-                next_ctl = "({} & {})".format(ctl_t, ctl_of_timeseries(ts[0], ts[1:]))
+            def ctl_of_next(next_toggles):
+                if len(ts) == 1:
+                    return ctl_t
+                return "({} & {})".format(ctl_t,
+                            ctl_of_timeseries(ts[0], ts[1:], next_toggles))
 
             if not control_nodes:
-                return "EF {}".format(next_ctl)
+                return "EF {}".format(ctl_of_next(toggles))
 
             begin_control_state = control_state(t)
             next_control_state = control_state(ts[0])
@@ -178,6 +272,21 @@ def make_smv(dataset, network, destfile, update=U_GENERAL):
             changing_control = [n for n in control_nodes \
                         if begin_control_state[n] != next_control_state[n]]
 
+            next_toggles = toggles.copy()
+            for n in changing_control:
+                next_toggles[n] += 1
+            next_ctl = ctl_of_next(next_toggles)
+
+            if encoding == CTL_COUNTERS:
+                steady = []
+                for n in sorted(control_nodes):
+                    if n in changing_control:
+                        steady.append("(toggles_{0} = {1} | toggles_{0} = {2})"\
+                                        .format(n, toggles[n], next_toggles[n]))
+                    else:
+                        steady.append("toggles_{0} = {1}".format(n, toggles[n]))
+                return "E [{} U {}]".format(" & ".join(steady), next_ctl)
+
             control_paths = []
             for stages in control_stages(changing_control):
                 cur_control_state = begin_control_state.copy()
@@ -207,21 +316,290 @@ def make_smv(dataset, network, destfile, update=U_GENERAL):
         ts = list(sorted(exp.obs.keys()))
         if ts[0] == 0:
             ts.pop(0)
-        ctl = ctl_of_timeseries(0, ts)
+        ctl = ctl_of_timeseries(0, ts, dict((n, 0) for n in control_nodes))
 
         return "((E{exp}_SETUP & E{exp}_T0) -> {ctl})"\
                 .format(exp=exp.id, ctl=ctl)
 
-    smv.write("CTLSPEC ")
-    smv.write("\n & ".join([ctl_of_exp(exp) for exp in dataset.experiments.values()]))
-    smv.write("\n")
-
-    smv.close()
-    return destfile
+    if exp_ids is None:
+        exp_ids = sorted(dataset.experiments)
+    specs = {}
+    for eid in exp_ids:
+        specs[eid] = ctl_of_exp(dataset.experiments[eid])
+        smv.write("CTLSPEC NAME %s := %s;\n" % (spec_name(eid), specs[eid]))
+    return specs
+
+def spec_name(eid):
+    return "E%d_SPEC" % eid
+
+def cone_of_influence(dataset, network, eid):
+    """
+    Returns the nodes whose formula may change the verdict of the property
+    of experiment `eid`: the nodes observed in the experiment and,
+    transitively, their regulators. Control nodes are excluded (their
+    formula is not used), as well as the nodes clamped in the experiment,
+    which are returned separately: only whether they have a formula matters
+    (if so, they are randomized by the initial step).
+    """
+    exp = dataset.experiments[eid]
+    formulas = dict(network.formulas_iter())
+
+    todo = set()
+    for values in exp.obs.values():
+        todo.update(values.keys())
+    cone = set()
+    clamped = set()
+    while todo:
+        n = todo.pop()
+        if n in cone or n in clamped or n in dataset.control_nodes:
+            continue
+        if exp.mutations.get(n, 0):
+            clamped.add(n)
+            continue
+        cone.add(n)
+        for clause in formulas.get(n, ()):
+            todo.update([m for m, _ in clause])
+    return cone, clamped
+
+def network_projection(dataset, network):
+    """
+    Returns a projection of the network such that networks with the same
+    projection have the same verdict for each experiment: the formulas of
+    the nodes in the cones of influence of the experiments, and whether the
+    clamped nodes met have a formula.
+    """
+    formulas = dict(network.formulas_iter())
+    nodes = set()
+    clamped = set()
+    for eid in dataset.experiments:
+        cone, cone_clamped = cone_of_influence(dataset, network, eid)
+        nodes.update(cone)
+        clamped.update(cone_clamped)
+    clamped.difference_update(nodes)
+    return (frozenset([(n, formulas.get(n)) for n in nodes]),
+            frozenset([(n, n in formulas) for n in clamped]))
 
 def verify(dataset, network, destfile, *args, **kwargs):
     smvfile = make_smv(dataset, network, destfile, *args, **kwargs)
     output = subprocess.check_output(["NuSMV", "-coi", "-dcx", smvfile])
-    ret = output.strip().split()[-1].decode()
-    return ret == "true"
-
+    return all([l.rstrip().endswith("is true") \
+                for l in output.decode().splitlines() \
+                if l.startswith("-- specification")])
+
+
+class ExperimentOrder(object):
+    """
+    Orders experiments by decreasing number of past failures, so that
+    networks are rejected by checking as few experiments as possible.
+    """
+    def __init__(self):
+        self.failures = {}
+
+    def __call__(self, exp_ids):
+        return sorted(exp_ids, key=lambda eid: -self.failures.get(eid, 0))
+
+    def record(self, eid):
+        self.failures[eid] = self.failures.get(eid, 0) + 1
+
+
+class NuSMVError(Exception):
+    pass
+
+class NuSMVSession(object):
+    """
+    Long-lived NuSMV process in interactive mode.
+
+    Models are written to a named pipe which NuSMV reads as its input file,
+    hence no process nor temporary file is created per network.
+    The process is restarted if it dies. The pipe is created in a new
+    directory of `tmpdir` (default: the system one), removed by close.
+    """
+    marker = "__caspots_done__"
+
+    def __init__(self, update=U_GENERAL, program="NuSMV", tmpdir=None):
+        self.update = update
+        self.program = program
+        self.order = ExperimentOrder()
+        self.workdir = tempfile.mkdtemp(prefix="caspots-nusmv-", dir=tmpdir)
+        self.fifo = os.path.join(self.workdir, "model.smv")
+        os.mkfifo(self.fifo)
+        self.proc = None
+
+    def start(self):
+        self.proc = subprocess.Popen([self.program, "-int", "-coi", "-dcx"],
+                        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                        stderr=subprocess.STDOUT, universal_newlines=True,
+                        bufsize=1)
+        self.communicate([])
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc = None
+
+    def close(self):
+        if self.proc is not None and self.proc.poll() is None:
+            try:
+                self.proc.stdin.write("quit\n")
+                self.proc.stdin.close()
+                self.proc.wait()
+            except IOError:
+                pass
+        self.stop()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def feed(self, model):
+        # opening the pipe blocks until NuSMV reads it: poll to notice a crash
+        while True:
+            try:
+                fd = os.open(self.fifo, os.O_WRONLY | os.O_NONBLOCK)
+                break
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+                if self.proc.poll() is not None:
+                    raise NuSMVError("NuSMV exited with status %s" \
+                                        % self.proc.returncode)
+                time.sleep(0.001)
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+        with os.fdopen(fd, "w") as f:
+            f.write(model)
+
+    def communicate(self, commands, model=None):
+        """
+        Runs the given commands, feeding `model` to the input file if given,
+        and returns the output lines.
+        """
+        try:
+            for cmd in commands + ["echo %s" % self.marker]:
+                self.proc.stdin.write("%s\n" % cmd)
+            self.proc.stdin.flush()
+            if model is not None:
+                self.feed(model)
+        except IOError as e:
+            raise NuSMVError("NuSMV is not responding: %s" % e)
+        lines = []
+        while True:
+            line = self.proc.stdout.readline()
+            if not line:
+                raise NuSMVError("NuSMV exited unexpectedly:\n%s" \
+                                    % "".join(lines))
+            if self.marker in line:
+                return lines
+            lines.append(line)
+
+    def run(self, func):
+        """
+        Calls func(), restarting NuSMV once if it is not responding
+        """
+        for attempt in range(2):
+            if self.proc is None or self.proc.poll() is not None:
+                self.start()
+            try:
+                return func()
+            except NuSMVError:
+                self.stop()
+                if attempt:
+                    raise
+
+    @staticmethod
+    def results(output):
+        results = [l.rstrip().endswith("is true") for l in output \
+                    if "-- specification" in l]
+        if not results:
+            raise NuSMVError("no specification checked:\n%s" % "".join(output))
+        return results
+
+    def failing_experiment(self, dataset, network, exp_ids=None):
+        """
+        Returns the first experiment (among `exp_ids`, default: all)
+        whose property is false, or None.
+        The properties are checked one by one, stopping at the first failure.
+        """
+        if exp_ids is None:
+            exp_ids = dataset.experiments
+        exp_ids = self.order(exp_ids)
+        smv = StringIO()
+        write_smv(smv, dataset, network, self.update, exp_ids)
+        model = smv.getvalue()
+
+        def check_each():
+            self.communicate(["set input_file %s" % self.fifo, "go"], model)
+            try:
+                for eid in exp_ids:
+                    output = self.communicate(["check_ctlspec -P %s" \
+                                                    % spec_name(eid)])
+                    if not all(self.results(output)):
+                        return eid
+                return None
+            finally:
+                self.communicate(["reset"])
+
+        failing = self.run(check_each)
+        if failing is not None:
+            self.order.record(failing)
+        return failing
+
+    def failing_experiments(self, dataset, networks, exp_ids=None):
+        """
+        Returns the first failing experiment of each of the networks (which
+        should define formulas for the same nodes), or None, from a single
+        model (see write_batch_smv).
+
+        For each experiment, the property restricted to the networks not yet
+        rejected is checked until it is true; each counterexample gives a
+        network failing the experiment.
+        """
+        if len(networks) == 1:
+            return [self.failing_experiment(dataset, networks[0], exp_ids)]
+        if exp_ids is None:
+            exp_ids = dataset.experiments
+        exp_ids = self.order(exp_ids)
+        smv = StringIO()
+        specs = write_batch_smv(smv, dataset, networks, self.update, exp_ids)
+        model = smv.getvalue()
+
+        def check_each():
+            failing = [None] * len(networks)
+            self.communicate(["set input_file %s" % self.fifo, "go",
+                                "set counter_examples 1"], model)
+            try:
+                for eid in exp_ids:
+                    while None in failing:
+                        failed = [i for i, f in enumerate(failing) if f is not None]
+                        spec = specs[eid]
+                        if failed:
+                            spec = "!(net in {%s}) -> %s" \
+                                    % (", ".join(map(str, failed)), spec)
+                        output = self.communicate(['check_ctlspec -p "%s"' % spec])
+                        if all(self.results(output)):
+                            break
+                        nets = [int(m.group(1)) for m in \
+                                    map(self.net_value.match, output) if m]
+                        if nets:
+                            if nets[0] >= len(networks) \
+                                    or failing[nets[0]] is not None:
+                                # would loop forever on the same counterexample
+                                raise NuSMVError("unexpected counterexample "\
+                                    "for network %d:\n%s" \
+                                    % (nets[0], "".join(output)))
+                            failing[nets[0]] = eid
+                        else:
+                            # net is not in the cone of influence
+                            failing = [eid if f is None else f for f in failing]
+                return failing
+            finally:
+                self.communicate(["set counter_examples 0", "reset"])
+
+        failing = self.run(check_each)
+        for eid in failing:
+            if eid is not None:
+                self.order.record(eid)
+        return failing
+
+    net_value = re.compile(r"\s*net = (\d+)")
+
+    def verify(self, dataset, network):
+        return self.failing_experiment(dataset, network) is None
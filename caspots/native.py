@@ -0,0 +1,320 @@
+
+from .modelchecking import U_GENERAL, U_ASYNC, NuSMVSession, ExperimentOrder
+from .utils import *
+
+class StateSpaceTooLarge(Exception):
+    pass
+
+def submasks(mask):
+    """
+    Yields all the sub-masks of the given bit mask
+    """
+    sub = mask
+    while True:
+        yield sub
+        if not sub:
+            return
+        sub = (sub - 1) & mask
+
+def bits(mask):
+    while mask:
+        b = mask & -mask
+        yield b
+        mask ^= b
+
+class ExplicitModel(object):
+    """
+    Explicit-state counterpart of the model and CTL property written by
+    `modelchecking.write_smv`.
+
+    States are integers with one bit per node. The `u_*` variables of the SMV
+    model are abstracted by letting any subset (general) or at most one
+    (asynchronous) of the unstable nodes be updated at each step.
+    The property is checked by backward reachability over the states
+    reachable after the initial `start` step.
+    """
+    def __init__(self, dataset, network, update=U_GENERAL, max_states=2**16):
+        self.dataset = dataset
+        self.update = update
+        self.max_states = max_states
+
+        dvars = dataset.setup.nodes.union(network.variables())
+        self.bit = dict((n, 1 << i) for i, n in enumerate(sorted(dvars)))
+
+        self.control_nodes = dataset.control_nodes
+        formulas = dict(network.formulas_iter())
+        varying_nodes = set(formulas)
+        varying_nodes.update(self.control_nodes)
+        self.varying = self.mask(varying_nodes)
+
+        self.dirty_start = set()
+        for exp in dataset.experiments.values():
+            if 0 not in exp.obs:
+                self.dirty_start.update(dataset.readout)
+                break
+            else:
+                readouts0 = set(exp.obs[0].keys())
+                self.dirty_start.update(dataset.readout.difference(readouts0))
+
+        self.clampable = varying_nodes.intersection(dataset.inhibitors.union(dataset.stimulus))
+        assert not self.control_nodes.intersection(self.clampable), \
+            "Control nodes should not be declared as TR!"
+
+        # nodes randomized by the start step, in addition to dirty readouts
+        self.randomized = self.mask([n for n in varying_nodes \
+                                        if n not in dataset.readout])
+        self.dirty_varying = varying_nodes.intersection(self.dirty_start)
+        self.control = self.mask(self.control_nodes)
+
+        self.clauses = {}
+        for n, clauses in formulas.items():
+            if n in self.control_nodes:
+                continue
+            self.clauses[n] = [self.literals(clause) for clause in clauses]
+
+    def mask(self, nodes):
+        m = 0
+        for n in nodes:
+            m |= self.bit[n]
+        return m
+
+    def literals(self, values):
+        """
+        Returns (mask, value) such that state & mask == value
+        iff the state matches the given (node, value) pairs
+        """
+        m = v = 0
+        for n, s in values:
+            m |= self.bit[n]
+            if s > 0:
+                v |= self.bit[n]
+        return (m, v)
+
+    def transition_function(self, exp):
+        funcs = []
+        for n, clauses in self.clauses.items():
+            c = exp.mutations.get(n, 0) if n in self.clampable else 0
+            if c:
+                funcs.append((self.bit[n], c > 0))
+            else:
+                funcs.append((self.bit[n], clauses))
+        toggles = self.control
+
+        def image(x):
+            y = x ^ toggles
+            for b, f in funcs:
+                if f is True or f is False:
+                    v = f
+                else:
+                    v = False
+                    for m, s in f:
+                        if x & m == s:
+                            v = True
+                            break
+                if v:
+                    y |= b
+                else:
+                    y &= ~b
+            return y
+        return image
+
+    def successors(self, image, x):
+        diff = (x ^ image(x)) & self.varying
+        if self.update == U_ASYNC:
+            return [x ^ b for b in bits(diff)]
+        return [x ^ s for s in submasks(diff) if s]
+
+    def check(self, exp_ids=None):
+        """
+        Returns the first experiment whose property is false, or None
+        """
+        experiments = self.dataset.experiments
+        for eid in (experiments if exp_ids is None else exp_ids):
+            if not self.check_experiment(experiments[eid]):
+                return eid
+        return None
+
+    def segments(self, exp):
+        """
+        Returns the list of (atom, box, target) describing the nested
+        reachability properties along the time series of the experiment.
+        box and target are None when there are no control nodes.
+        """
+        def control_state(t):
+            return dict([(n,v) for (n,v) in exp.obs[t].items() if n in self.control_nodes])
+        ts = list(sorted(exp.obs.keys()))
+        if ts[0] == 0:
+            ts.pop(0)
+        segs = []
+        t0 = 0
+        for t in ts:
+            atom = self.literals(exp.obs[t].items())
+            box = target = None
+            if self.control_nodes:
+                begin = control_state(t0)
+                end = control_state(t)
+                for n in self.control_nodes:
+                    assert n in begin, \
+                        "Exp {}: {} is not defined at t={}".format(exp.id, n, t0)
+                    assert n in end, \
+                        "Exp {}: {} is not defined at t={}".format(exp.id, n, t)
+                changing = [n for n in self.control_nodes if begin[n] != end[n]]
+                steady = [(n, v) for (n, v) in begin.items() if n not in changing]
+                box = self.literals(steady)
+                target = self.literals([(n, end[n]) for n in changing])
+            segs.append((atom, box, target))
+            t0 = t
+        return segs
+
+    def check_experiment(self, exp):
+        segs = self.segments(exp)
+        if not segs:
+            return True
+
+        setup = self.literals([(n, c) for (n, c) in exp.mutations.items()])
+        if 0 in exp.obs:
+            t0 = self.literals(exp.obs[0].items())
+            dirty = [n for n in self.dirty_varying if n in exp.obs[0]]
+        else:
+            t0 = (0, 0)
+            dirty = self.dirty_varying
+        if (setup[0] & t0[0]) & (setup[1] ^ t0[1]):
+            # no initial state
+            return True
+        fixed = setup[0] | t0[0]
+        fixed_val = setup[1] | t0[1]
+
+        randomized = self.randomized | self.mask(dirty)
+        atoms = 0
+        for atom, _, _ in segs:
+            atoms |= atom[0]
+        free = ~fixed & ((1 << len(self.bit)) - 1)
+        # free bits which are kept by the start step must be enumerated;
+        # randomized bits only matter for evaluating atoms in the initial state
+        core_free = free & ~randomized
+        start_free = free & randomized & atoms
+        if bin(start_free).count("1") > 16:
+            raise StateSpaceTooLarge()
+
+        image = self.transition_function(exp)
+        nb_states = [0]
+        for core in submasks(core_free):
+            base = fixed_val | core
+            first = [(base & ~randomized) | r for r in submasks(randomized)]
+            sat = self.label(image, first, segs, nb_states)
+
+            memo = {}
+            def reaches(k, s):
+                # some start successor satisfies segment k
+                key = (k, s & self.control)
+                if key not in memo:
+                    _, box, target = segs[k]
+                    memo[key] = any(p in sat[k] and self.step(box, target, s, p) \
+                                        for p in first)
+                return memo[key]
+
+            def holds(k, s):
+                atom, box, _ = segs[k]
+                if s & atom[0] == atom[1] \
+                        and (k + 1 == len(segs) or holds(k+1, s)):
+                    return True
+                if box is not None and s & box[0] != box[1]:
+                    return False
+                return reaches(k, s)
+
+            for a in submasks(start_free):
+                if not holds(0, (base & ~start_free) | a):
+                    return False
+        return True
+
+    def step(self, box, target, x, y):
+        """
+        Tests whether the transition x -> y respects the monotonic progress
+        of changing control nodes towards their target value
+        """
+        if box is None:
+            return True
+        m, v = target
+        return (~(x ^ v) & m) & ~(~(y ^ v) & m) == 0
+
+    def label(self, image, first, segs, nb_states):
+        preds = {}
+        for x in first:
+            preds.setdefault(x, [])
+        todo = list(preds)
+        nb_states[0] += len(todo)
+        while todo:
+            x = todo.pop()
+            for y in self.successors(image, x):
+                if y not in preds:
+                    preds[y] = []
+                    todo.append(y)
+                    nb_states[0] += 1
+                    if nb_states[0] > self.max_states:
+                        raise StateSpaceTooLarge()
+                preds[y].append(x)
+
+        sat = [None] * len(segs)
+        reach = None
+        for k in reversed(range(len(segs))):
+            (m, v), box, target = segs[k]
+            goal = [x for x in preds if x & m == v \
+                        and (reach is None or x in reach)]
+            reach = set(goal)
+            while goal:
+                y = goal.pop()
+                for x in preds[y]:
+                    if x in reach:
+                        continue
+                    if box is not None and (x & box[0] != box[1] \
+                            or not self.step(box, target, x, y)):
+                        continue
+                    reach.add(x)
+                    goal.append(x)
+            sat[k] = reach
+        return sat
+
+
+class NativeChecker(object):
+    """
+    Checks networks with ExplicitModel, falling back to NuSMV when the state
+    space exceeds `max_states`.
+    """
+    def __init__(self, update=U_GENERAL, max_states=2**16, tmpdir=None):
+        self.update = update
+        self.max_states = max_states
+        self.tmpdir = tmpdir
+        self.fallback = None
+        self.order = ExperimentOrder()
+        self.stats = {"native": 0, "nusmv": 0}
+
+    def failing_experiment(self, dataset, network, exp_ids=None):
+        if exp_ids is None:
+            exp_ids = dataset.experiments
+        exp_ids = self.order(exp_ids)
+        model = ExplicitModel(dataset, network, self.update, self.max_states)
+        try:
+            failing = model.check(exp_ids)
+        except StateSpaceTooLarge:
+            if self.fallback is None:
+                self.fallback = NuSMVSession(self.update, tmpdir=self.tmpdir)
+                # the fallback records its failures in the same statistics
+                self.fallback.order = self.order
+            self.stats["nusmv"] += 1
+            return self.fallback.failing_experiment(dataset, network, exp_ids)
+        self.stats["native"] += 1
+        if failing is not None:
+            self.order.record(failing)
+        return failing
+
+    def failing_experiments(self, dataset, networks, exp_ids=None):
+        # explicit states cannot be shared between networks
+        return [self.failing_experiment(dataset, network, exp_ids) \
+                    for network in networks]
+
+    def verify(self, dataset, network):
+        return self.failing_experiment(dataset, network) is None
+
+    def close(self):
+        if self.fallback is not None:
+            self.fallback.close()
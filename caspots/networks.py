@@ -1,11 +1,15 @@
 
+import csv
 import itertools as it
+import threading
 
 import gringo
 
+import numpy as np
 import pandas as pd
 
-from caspo.core import Clause
+from caspo.core import Clause, HyperGraph, LogicalNetwork
+from caspo.core.mapping import Mapping
 
 from .asputils import *
 
@@ -18,9 +22,103 @@ def network_str(network):
     return " / ".join(["%s = %s" % (v,clause_str(c)) for v,c in network.formulas_iter()])
 
 
+def hyperedges(hypergraph):
+    """
+    Hyperedge index of each mapping (clause, target) of the hypergraph.
+    Unlike clauses_idx, it tells apart the hyperedges of a clause shared by
+    several targets.
+    """
+    nodes = hypergraph.nodes
+    clauses = hypergraph.clauses
+    return dict((Mapping(clauses[j], nodes[i]), j) \
+                    for j, i in hypergraph.hyper.iteritems())
+
+
+class NetworkDecoder(object):
+    """
+    Maps the dnf(I,J) atoms of models to the positions of the corresponding
+    mappings of the hypergraph, and these positions to networks.
+    """
+    def __init__(self, hypergraph):
+        self.mappings = list(hypergraph.mappings)
+        node_idx = dict(zip(hypergraph.nodes.values, hypergraph.nodes.index))
+        edges = hyperedges(hypergraph)
+        self.index = dict(((node_idx[m.target], edges[m]), pos) \
+                            for pos, m in enumerate(self.mappings) if m in edges)
+
+    def positions(self, dnf):
+        """
+        Sorted positions of the (I,J) pairs `dnf`
+        """
+        index = self.index
+        return np.array(sorted(index[(i, j)] for i, j in dnf), dtype=np.int32)
+
+    def row(self, positions):
+        """
+        Binary array over the mappings, as LogicalNetwork.to_array
+        """
+        arr = np.zeros(len(self.mappings), np.int8)
+        arr[positions] = 1
+        return arr
+
+    def network(self, positions):
+        mappings = self.mappings
+        return LogicalNetwork([mappings[p] for p in positions], networks=1)
+
+
+class NetworkWriter(object):
+    """
+    Writes networks to a CSV file as they are appended, with the columns of
+    LogicalNetworkList.to_csv. The file is only created with the first
+    network. A network is flushed at most `flush_interval` seconds after it
+    is appended, by a timer, even if no other network follows.
+    """
+    flush_interval = 1.0
+
+    def __init__(self, filename, hypergraph):
+        self.filename = filename
+        self.mappings = hypergraph.mappings
+        self.fd = None
+        self.count = 0
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def append(self, network):
+        with self.lock:
+            if self.fd is None:
+                self.fd = open(self.filename, "w")
+                self.writer = csv.writer(self.fd, lineterminator="\n")
+                self.writer.writerow([str(m) for m in self.mappings])
+            self.writer.writerow(network.to_array(self.mappings))
+            self.count += 1
+            if self.timer is None:
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            self.timer = None
+            if self.fd is not None:
+                self.fd.flush()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.fd is not None:
+                self.fd.close()
+                self.fd = None
+
+
 def domain_of_networks(networks):
 
     hg = networks.hg
+    edges = hyperedges(hg)
 
     domain = ["1{%s}1." % ("; ".join(["model(%d)" % i for i in range(len(networks))]))]
 
@@ -31,15 +129,101 @@ def domain_of_networks(networks):
             f = gringo.Fun("formula", [v, variable])
             domain.append("%s :- model(%d)." % (f,i))
             for clause in formula:
-                clause_idx = hg.clauses_idx[clause]
+                clause_idx = edges[Mapping(clause, v)]
                 d = gringo.Fun("dnf",[variable, clause_idx])
                 domain.append("%s :- %s." % (d,m))
-                for variable, sign in clause:
-                    c = gringo.Fun("clause", [clause_idx, variable, sign])
+                for source, sign in clause:
+                    c = gringo.Fun("clause", [clause_idx, source, sign])
                     domain.append("%s :- %s." % (c,m))
 
     return "%s\n" % "\n".join(domain)
 
+def network_exclusion(hypergraph, network, nodes, defined=(), edges=None):
+    """
+    Returns an ASP constraint excluding the networks which have the same
+    formulas as `network` for the given nodes, and which define a formula
+    for the same nodes among `defined`. `edges` are the hyperedges of the
+    hypergraph (see hyperedges), computed if not given.
+    """
+    if edges is None:
+        edges = hyperedges(hypergraph)
+    formulas = dict(network.formulas_iter())
+    body = []
+    def index(v):
+        vi = hypergraph.nodes[hypergraph.nodes == v].index
+        if len(vi) == 0 or not (hypergraph.hyper == vi[0]).any():
+            # no formula to guess
+            return None
+        return vi[0]
+    for v in sorted(nodes):
+        vi = index(v)
+        if vi is None:
+            continue
+        clauses = formulas.get(v, [])
+        for clause in clauses:
+            body.append("dnf(%d,%d)" % (vi, edges[Mapping(clause, v)]))
+        body.append("%d{dnf(%d,J): hyper(%d,J,N)}%d" \
+                        % (len(clauses), vi, vi, len(clauses)))
+    for v in sorted(defined):
+        vi = index(v)
+        if vi is None:
+            continue
+        if v in formulas:
+            body.append("1{dnf(%d,J): hyper(%d,J,N)}" % (vi, vi))
+        else:
+            body.append("{dnf(%d,J): hyper(%d,J,N)}0" % (vi, vi))
+    return ":- %s." % (", ".join(body) or "#true")
+
+def closure(roots, succ):
+    seen = set(roots)
+    todo = list(seen)
+    while todo:
+        for v in succ.get(todo.pop(), ()):
+            if v not in seen:
+                seen.add(v)
+                todo.append(v)
+    return seen
+
+def prune_hypergraph(hypergraph, stimuli, readouts, controllable=True,
+                        keep=()):
+    """
+    Removes the hyperedges which cannot be used by a network satisfying the
+    constraints of guessBN.lp: their target must be a readout or reach one,
+    and, if `controllable`, their sources must be stimuli or be reached by
+    one, using the remaining hyperedges only.
+    The nodes of no remaining hyperedge are removed as well, unless they are
+    stimuli, readouts or in `keep`.
+    Hyperedges and nodes keep their indexes.
+    """
+    names = hypergraph.nodes
+    target = dict(zip(hypergraph.hyper.index, names[hypergraph.hyper.values]))
+    sources = dict((j, set(e["name"])) \
+                    for j, e in hypergraph.edges.groupby("hyper_idx"))
+    alive = set(target)
+    while True:
+        succ = {}
+        pred = {}
+        for j in alive:
+            for u in sources[j]:
+                succ.setdefault(u, set()).add(target[j])
+                pred.setdefault(target[j], set()).add(u)
+        observable = closure(readouts, pred)
+        kept = set([j for j in alive if target[j] in observable])
+        if controllable:
+            controlled = closure(stimuli, succ)
+            kept = set([j for j in kept if sources[j] <= controlled])
+        if kept == alive:
+            break
+        alive = kept
+    used = set(keep).union(stimuli, readouts)
+    for j in alive:
+        used.add(target[j])
+        used.update(sources[j])
+    edges = hypergraph.edges
+    return HyperGraph(names[names.isin(used)],
+                hypergraph.hyper[hypergraph.hyper.index.isin(alive)],
+                edges[edges["hyper_idx"].isin(alive)])
+
 def restrict_with_partial_bn(hypergraph, partial_bn_file):
     asp = []
 
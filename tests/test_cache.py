@@ -0,0 +1,130 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from caspo.core import Graph
+
+from caspots.cache import DatasetCache, GroundCache, VerdictCache, NOT_CACHED
+from caspots.dataset import Dataset
+
+class GroundCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.lp = os.path.join(self.dir, "program.lp")
+        with open(self.lp, "w") as fd:
+            fd.write("a :- b.\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def gringo(self, version):
+        # executable only answering --version
+        path = os.path.join(self.dir, "gringo-%s" % version)
+        with open(path, "w") as fd:
+            fd.write("#!/bin/sh\necho gringo version %s\n" % version)
+        os.chmod(path, stat.S_IRWXU)
+        return path
+
+    def test_missing_gringo(self):
+        cache = GroundCache(os.path.join(self.dir, "cache"),
+                            gringo=os.path.join(self.dir, "missing"))
+        self.assertIsNone(cache.version())
+        self.assertIsNone(cache.program([self.lp], "b.\n"))
+        self.assertEqual(os.listdir(cache.directory), [])
+
+    def test_version_key(self):
+        keys = set()
+        for version in ["4.5.4", "5.4.0"]:
+            cache = GroundCache(os.path.join(self.dir, "cache"),
+                                gringo=self.gringo(version))
+            self.assertIn(version, cache.version())
+            keys.add(cache.key([self.lp], "b.\n"))
+        self.assertEqual(len(keys), 2)
+
+class VerdictCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def rows(self, cache):
+        return cache.db.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+
+    def test_eviction(self):
+        cache = VerdictCache(self.dir, max_entries=10)
+        cache.commit_every = 4
+        for i in range(25):
+            cache.put("k%d" % i, i)
+            # replacing a verdict does not add an entry
+            cache.put("k%d" % i, None)
+            self.assertEqual(cache.count, self.rows(cache))
+        cache.close()
+        self.assertEqual(cache.evicted, 15)
+        cache = VerdictCache(self.dir, max_entries=10)
+        self.assertEqual(cache.count, 10)
+        self.assertEqual(cache.get("k0"), NOT_CACHED)
+        self.assertIsNone(cache.get("k24"))
+        cache.close()
+
+class DatasetCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.midas = os.path.join(self.dir, "data.csv")
+        # the experiment without stimulus has a single data point
+        with open(self.midas, "w") as fd:
+            fd.write("TR:a,TR:bi,DA:ALL,DV:b,DV:c\n"
+                     "0,0,10,0.7,0.285\n"
+                     "1,1,0,0.2,0.4\n1,1,10,0.9,\n1,1,20,0.5,0.6\n")
+        self.graph = Graph.from_tuples([("a", "b", 1), ("b", "c", 1)])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def load(self, compact, cache=None):
+        dataset = Dataset("data", compact=compact)
+        if cache is None:
+            dataset.load_from_midas(self.midas, self.graph)
+            return dataset
+        key = cache.key(self.midas, dataset, self.graph)
+        if not cache.load(key, dataset):
+            dataset.load_from_midas(self.midas, self.graph)
+            cache.save(key, dataset)
+        return dataset
+
+    def assertSameDataset(self, cached, fresh):
+        self.assertEqual(cached.setup.stimuli, fresh.setup.stimuli)
+        self.assertEqual(cached.setup.inhibitors, fresh.setup.inhibitors)
+        self.assertEqual(cached.setup.readouts, fresh.setup.readouts)
+        self.assertEqual(sorted(cached.experiments), sorted(fresh.experiments))
+        for eid, exp in fresh.experiments.items():
+            other = cached.experiments[eid]
+            self.assertEqual(other.mutations, exp.mutations)
+            self.assertEqual(dict((t, dict(v)) for t, v in other.obs.items()),
+                             dict((t, dict(v)) for t, v in exp.obs.items()))
+            self.assertEqual(dict((t, dict(v)) for t, v in other.dobs.items()),
+                             dict((t, dict(v)) for t, v in exp.dobs.items()))
+        self.assertEqual(cached.warnings, fresh.warnings)
+        store, expected = cached.observations(), fresh.observations()
+        for attr in ["eids", "times", "nodes"]:
+            self.assertEqual(list(getattr(store, attr)),
+                             list(getattr(expected, attr)))
+        for name in DatasetCache.arrays:
+            self.assertEqual(getattr(store, name).tolist(),
+                             getattr(expected, name).tolist())
+        self.assertEqual(list(store.entries()), list(expected.entries()))
+
+    def test_round_trip(self):
+        cache = DatasetCache(os.path.join(self.dir, "cache"))
+        for compact in [False, True]:
+            fresh = self.load(compact)
+            self.assertEqual(len(fresh.warnings), 1)
+            # saved by the first load, then loaded from the cache
+            self.load(compact, cache)
+            self.assertEqual(len(os.listdir(cache.directory)), 1)
+            self.assertSameDataset(self.load(compact, cache), fresh)
+
+if __name__ == "__main__":
+    unittest.main()
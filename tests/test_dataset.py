@@ -0,0 +1,145 @@
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from caspo.core import Graph
+
+from caspots.dataset import Dataset, Experiment
+
+DATASETS = os.path.join(os.path.dirname(__file__), "..", "datasets")
+
+def legacy_load_from_midas(dataset, midas, graph):
+    """
+    Row-wise loader which Dataset.load_from_midas replaced; only the setup
+    and the experiments are set
+    """
+    df = pd.read_csv(midas)
+    df = df.reset_index(drop=True)
+
+    def is_stimulus(name):
+        if name.lower() == 'tr:cell:cellline':
+            return False
+        return name.startswith('TR') and not name.endswith('i')
+    def is_inhibitor(name):
+        return name.startswith('TR') and name.endswith('i')
+    def is_readout(name):
+        return name.startswith('DV')
+
+    stimuli = [c[3:] for c in df.columns if is_stimulus(c)]
+    inhibitors = [c[3:-1] for c in df.columns if is_inhibitor(c)]
+    readouts = [c[3:] for c in df.columns if is_readout(c)]
+    dataset.setup = (stimuli, inhibitors, readouts)
+    dataset.experiments = {}
+
+    exp_t = {}
+    order = {}
+    def exp_of_clamps(cellline, clamps, time):
+        key = (cellline, clamps, time)
+        order[key] = order.get(key, 0) + 1
+        key = (cellline, clamps, order[key])
+        if key not in exp_t:
+            eid = len(exp_t)
+            exp = Experiment(eid)
+            for node, clamp in clamps:
+                exp.add_mutation(node, clamp)
+            dataset.experiments[eid] = exp
+            exp_t[key] = exp
+        return exp_t[key]
+
+    for i, row in df.iterrows():
+        clamps = set()
+        cellline = None
+        for var, sign in row.filter(regex='^TR').iteritems():
+            if var.lower() == 'tr:cell:cellline':
+                cellline = int(sign)
+                continue
+            var = var[3:]
+            sign = int(sign)
+            if var in stimuli:
+                if sign == 1 or not len(graph.predecessors(var)):
+                    clamps.add((var, sign or -1))
+            elif sign == 1:
+                clamps.add((var[:-1], -1))
+        clamps = tuple(sorted(clamps))
+
+        times = list(set(map(int, row.filter(regex='^DA:').values)))
+        assert len(times) == 1
+        exp = exp_of_clamps(cellline, clamps, times[0])
+
+        for var, fvalue in row.filter(regex='^DV').iteritems():
+            if np.isnan(fvalue):
+                continue
+            var = var[3:]
+            time = int(row.get("DA:%s" % var, row.get("DA:ALL")))
+            dvalue = dataset.discretize(fvalue)
+            exp.add_obs(time, var, dataset.binarize(dvalue), dvalue)
+
+    for eid, exp in list(dataset.experiments.items()):
+        if len(exp.obs) == 1 and 0 in exp.obs:
+            del dataset.experiments[eid]
+
+def content(dataset):
+    return dict((eid, (exp.mutations, exp.obs, exp.dobs)) \
+                    for eid, exp in dataset.experiments.items())
+
+class LoadFromMidasTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def assertSameLoad(self, midas, graph):
+        legacy = Dataset("legacy")
+        legacy_load_from_midas(legacy, midas, graph)
+        dataset = Dataset("columns")
+        dataset.load_from_midas(midas, graph)
+        self.assertEqual((dataset.setup.stimuli, dataset.setup.inhibitors,
+                            dataset.setup.readouts), legacy.setup)
+        self.assertEqual(content(dataset), content(legacy))
+
+    def midas(self, rows):
+        path = os.path.join(self.dir, "data.csv")
+        with open(path, "w") as fd:
+            fd.write("\n".join(rows) + "\n")
+        return path
+
+    def test_datasets(self):
+        paths = sorted(glob.glob(os.path.join(DATASETS, "*", "*.csv")) \
+                    + glob.glob(os.path.join(DATASETS, "*", "*", "*.csv")))
+        self.assertGreater(len(paths), 0)
+        for midas in paths:
+            directory = os.path.dirname(midas)
+            sif = sorted(glob.glob(os.path.join(directory, "pkn*.sif")))[0]
+            self.assertSameLoad(midas, Graph.read_sif(sif))
+
+    def test_edge_cases(self):
+        # b has a predecessor, not a; b is only clamped when stimulated;
+        # repeated rows go to distinct experiments; values like 0.285
+        # scale just below the rounding point
+        graph = Graph.from_tuples([("a", "b", 1), ("b", "c", 1),
+                                    ("c", "d", 1)])
+        rows = ["TR:Cell:CellLine,TR:a,TR:b,TR:ci,DA:ALL,DV:c,DV:d",
+                "1,0,0,0,0,0.285,0.005",
+                "1,0,0,0,10,0.125,",
+                "1,0,0,0,10,0.135,1",
+                "1,1,0,1,0,0.5,0.49999",
+                "1,1,0,1,10,,0.995",
+                "2,1,1,0,0,0.285,1",
+                "2,1,1,0,10,-0.005,0.015",
+                "2,0,1,0,10,0.7,0.3"]
+        self.assertSameLoad(self.midas(rows), graph)
+
+    def test_missing_clamping(self):
+        graph = Graph.from_tuples([("a", "b", 1)])
+        rows = ["TR:a,DA:ALL,DV:b", "1,0,0", ",10,1"]
+        with self.assertRaises(ValueError):
+            Dataset("missing").load_from_midas(self.midas(rows), graph)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import gringo
+
+from caspo.core import Graph, HyperGraph, LogicalNetworkList
+
+from caspots.asputils import funset
+from caspots.config import aspf
+from caspots.dataset import Dataset, SupportDomain
+from caspots.networks import domain_of_networks
+
+REFERENCE = os.path.join(os.path.dirname(__file__), "data",
+                            "supportConsistency.lp")
+
+class SupportConsistencyTest(unittest.TestCase):
+    """
+    The answer sets with supportConsistency.lp, restricted to the relevant
+    triples, must be those of the unrestricted encoding
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, text):
+        path = os.path.join(self.dir, name)
+        with open(path, "w") as fd:
+            fd.write(text)
+        return path
+
+    def dataset(self, graph, midas):
+        dataset = Dataset("test")
+        dataset.load_from_midas(self.write("dataset.csv", midas), graph)
+        return dataset
+
+    def answer_sets(self, domain, encoding, facts):
+        # answer sets projected on the shown atoms
+        control = gringo.Control(["0", "--project"])
+        for f in [domain, encoding, aspf("normalize.lp")]:
+            control.load(f)
+        control.add("base", [], facts + "#show dnf/2.\n#show guessed/4.\n")
+        control.ground([("base", [])])
+        found = []
+        control.solve(None, lambda model: found.append(frozenset(map(str,
+                                                            model.atoms()))))
+        return set(found)
+
+    def assertSameAnswerSets(self, domain, facts):
+        current = self.answer_sets(domain, aspf("supportConsistency.lp"), facts)
+        self.assertEqual(current, self.answer_sets(domain, REFERENCE, facts))
+        return current
+
+    def test_networks(self):
+        # --networks: the clause a is shared by c and d
+        graph = Graph.from_tuples([("a", "c", 1), ("a", "d", 1)])
+        dataset = self.dataset(graph, "TR:a,DA:ALL,DV:c,DV:d\n"
+                                      "1,0,0,0\n"
+                                      "1,1,1,0\n")
+        networks = LogicalNetworkList.from_csv(self.write("networks.csv",
+                                                    "c<-a,d<-a\n1,0\n"))
+        domain = self.write("domain.lp", domain_of_networks(networks))
+        facts = funset(networks.hg, dataset,
+                        SupportDomain(networks.hg, dataset)).to_str()
+        answers = self.assertSameAnswerSets(domain, facts)
+        # the trace fitting the data
+        self.assertTrue(any('guessed(0,1,"c",1)' in a \
+                            and 'guessed(0,1,"d",0)' in a for a in answers))
+
+    def test_pkn(self):
+        rng = random.Random(0)
+        nodes = ["a", "b", "c"]
+        for _ in range(5):
+            edges = set([("a", "b", 1)])
+            for target in nodes[1:]:
+                for source in rng.sample(nodes, 2):
+                    if source != target:
+                        edges.add((source, target, rng.choice([1, -1])))
+            graph = Graph.from_tuples(edges)
+            # b is inhibited in one experiment; no time point 1
+            rows = ["TR:a,TR:bi,DA:ALL,%s" \
+                        % ",".join("DV:%s" % n for n in nodes[1:])]
+            for a, bi in [(1, 0), (1, 1)]:
+                for t in [0, 2]:
+                    rows.append(",".join(map(str, [a, bi, t] \
+                        + [rng.choice([0, 0.3, 1]) for _ in nodes[1:]])))
+            dataset = self.dataset(graph, "\n".join(rows) + "\n")
+            hypergraph = HyperGraph.from_graph(graph)
+            facts = funset(hypergraph, dataset,
+                            SupportDomain(hypergraph, dataset)).to_str()
+            self.assertSameAnswerSets(aspf("guessBN.lp"), facts)
+
+if __name__ == "__main__":
+    unittest.main()
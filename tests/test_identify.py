@@ -0,0 +1,187 @@
+import argparse
+import math
+import os
+import shutil
+from StringIO import StringIO
+import sys
+import tempfile
+import time
+import unittest
+
+import gringo
+
+from caspo.core import Graph, HyperGraph
+
+from caspots import console, identify
+from caspots.asputils import funset
+from caspots.dataset import Dataset, SupportDomain
+
+def options(**kwargs):
+    opts = dict(factor=100, family="all", mincard_tolerance=0,
+                weight_tolerance=0, force_size=None, fully_controllable=False,
+                enum_traces=False, max_traces=1, clingo_parallel_mode=None,
+                debug=False, portfolio=None, split=0, split_jobs=1)
+    opts.update(kwargs)
+    return argparse.Namespace(**opts)
+
+class PerPartSolver(identify.ASPSolver):
+    """
+    Excludes each sample with the constraint of ASPSample.asp_exclusion,
+    grounded in a program part of its own
+    """
+    def exclude(self, control, sample, k):
+        prg = "excl%d" % k
+        control.add(prg, [], sample.asp_exclusion())
+        control.ground([(prg, [])])
+
+class Model(object):
+    def __init__(self, atoms):
+        self.atoms = lambda: atoms
+        self.optimization = lambda: [0]
+
+class SampleTest(unittest.TestCase):
+    def setUp(self):
+        obs = [(0, 10, "b", 70), (0, 10, "c", 30),
+                (1, 10, "b", 100), (1, 10, "c", 0)]
+        self.observed = identify.ObservedValues([gringo.Fun("obs", list(o)) \
+                                                    for o in obs], 100.)
+
+    def sample(self, measured, guessed):
+        atoms = [gringo.Fun("measured", list(key)) for key in measured]
+        atoms += [gringo.Fun("guessed", list(key)) for key in guessed]
+        return identify.ASPSample(options(), Model(atoms), self.observed)
+
+    def test_mse(self):
+        # no guessed value for (1,10,"c"); (0,0,"b") is not observed
+        sample = self.sample([(0, 10, "b", 1), (0, 10, "c", 0),
+                                (1, 10, "b", 1), (1, 10, "c", 0)],
+                             [(0, 10, "b", 1), (0, 10, "c", 0),
+                                (1, 10, "b", 1), (0, 0, "b", 1)])
+        mse0, mse = sample.mse()
+        self.assertAlmostEqual(mse0, math.sqrt((.09 + .09) / 4))
+        self.assertAlmostEqual(mse, math.sqrt((.09 + .09) / 3))
+        expected = {"experiment": {0: (.18, 2), 1: (0, 1)},
+                    "time": {10: (.18, 3)},
+                    "node": {"b": (.09, 2), "c": (.09, 1)}}
+        residuals = sample.residuals()
+        self.assertEqual(sorted(residuals), sorted(expected))
+        for name, groups in expected.items():
+            self.assertEqual(sorted(residuals[name]), sorted(groups))
+            for label, (total, count) in groups.items():
+                self.assertAlmostEqual(residuals[name][label][0], total)
+                self.assertEqual(residuals[name][label][1], count)
+        self.assertEqual(sample.residuals(guessed=False)["experiment"][1][1],
+                            2)
+
+    def test_no_values(self):
+        sample = self.sample([(0, 10, "b", 1)], [])
+        self.assertRaises(ZeroDivisionError, sample.mse)
+
+    def test_print_residuals(self):
+        residuals = {"experiment": {0: (1., 2), 1: (3., 1)},
+                     "time": {10: (4., 3)},
+                     "node": {"b": (2., 2), "c": (2., 1)}}
+        out = StringIO()
+        stdout, sys.stdout = sys.stdout, out
+        try:
+            console.print_residuals(residuals)
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(out.getvalue().splitlines(), [
+            "# squared errors by experiment", "1\t3.0\t1", "0\t0.5\t2",
+            "# squared errors by time", "10\t1.33333333333\t3",
+            "# squared errors by node", "b\t1.0\t2", "c\t2.0\t1"])
+
+class RacingSolver(identify.ASPSolver):
+    """
+    Solver whose optimum is the configuration, and whose process exits
+    without a result for the configurations starting with "exit"
+    """
+    def __init__(self):
+        pass
+
+    def optimum(self, conf):
+        if conf[0] == "exit":
+            os._exit(1)
+        if conf[0] == "fail":
+            raise ValueError(conf[1])
+        time.sleep(float(conf[1]))
+        return conf
+
+class RaceOptimumTest(unittest.TestCase):
+    def test_winner(self):
+        solver = RacingSolver()
+        self.assertEqual(solver.race_optimum([["exit", "1"], ["fail", "2"],
+                                    ["sleep", "0.5"]]), ["sleep", "0.5"])
+
+    def test_no_result(self):
+        solver = RacingSolver()
+        self.assertRaises(ValueError, solver.race_optimum,
+                            [["fail", "1"], ["fail", "2"]])
+        self.assertRaises(RuntimeError, solver.race_optimum,
+                            [["exit", "1"], ["fail", "2"]])
+
+class IdentifyTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        graph = Graph.from_tuples([("a", "b", 1), ("a", "c", 1),
+                                   ("b", "c", -1), ("c", "b", 1)])
+        midas = os.path.join(self.dir, "dataset.csv")
+        with open(midas, "w") as fd:
+            fd.write("TR:a,DA:ALL,DV:b,DV:c\n"
+                     "0,0,0,0\n"
+                     "0,10,0.1,0.2\n"
+                     "1,0,0,0\n"
+                     "1,10,0.9,0.3\n")
+        self.dataset = Dataset("test")
+        self.dataset.load_from_midas(midas, graph)
+        self.hypergraph = HyperGraph.from_graph(graph)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def solver(self, cls=identify.ASPSolver, **kwargs):
+        termset = funset(self.hypergraph, self.dataset,
+                            SupportDomain(self.hypergraph, self.dataset))
+        return cls(termset, options(**kwargs))
+
+    def networks(self, samples):
+        return [frozenset(map(tuple, s.dnf.tolist())) for s in samples]
+
+    def test_exclusion(self):
+        for family, tolerance in [("all", 1000), ("subset", 0),
+                                    ("mincard", 0)]:
+            solver = self.solver(family=family, weight_tolerance=tolerance,
+                                    mincard_tolerance=1)
+            # several blocks of exclusion slots
+            solver.exclusion_block = 2
+            networks = self.networks(solver.solution_samples())
+            expected = self.networks(self.solver(PerPartSolver, family=family,
+                                        weight_tolerance=tolerance,
+                                        mincard_tolerance=1)\
+                                        .solution_samples())
+            self.assertEqual(len(networks), len(set(networks)))
+            self.assertEqual(set(networks), set(expected))
+            if family == "all":
+                self.assertGreater(len(networks), solver.exclusion_block)
+
+    def solutions(self, limit=0, **kwargs):
+        found = []
+        self.solver(**kwargs).solutions(lambda model: found.append(
+            frozenset(map(tuple, identify.dnf_pairs(model.atoms()).tolist()))),
+            limit=limit)
+        return found
+
+    def test_split(self):
+        for family in ["subset", "mincard", "all"]:
+            opts = dict(family=family, weight_tolerance=20, mincard_tolerance=1)
+            expected = self.solutions(**opts)
+            split = self.solutions(split=2, split_jobs=2, **opts)
+            self.assertEqual(len(split), len(set(split)))
+            self.assertEqual(set(split), set(expected))
+            limited = self.solutions(limit=2, split=2, split_jobs=2, **opts)
+            self.assertEqual(len(limited), min(2, len(expected)))
+            self.assertTrue(set(limited) <= set(expected))
+
+if __name__ == "__main__":
+    unittest.main()
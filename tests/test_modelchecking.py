@@ -0,0 +1,188 @@
+from distutils.spawn import find_executable
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+
+from caspo.core import LogicalNetwork
+from caspo.core.clause import Clause
+from caspo.core.literal import Literal
+from caspo.core.setup import Setup
+
+from caspots import modelchecking
+from caspots import native
+from caspots.dataset import Dataset, Experiment
+
+HAS_NUSMV = find_executable("NuSMV") is not None
+
+def random_network(rng, nodes, stimuli):
+    mappings = []
+    for target in nodes:
+        if target in stimuli or rng.random() < .2:
+            continue
+        sources = [n for n in nodes if n != target]
+        for _ in range(rng.randint(1, 2)):
+            literals = [Literal(source, rng.choice([1, -1])) \
+                            for source in rng.sample(sources, rng.randint(1, 2))]
+            mappings.append((Clause(literals), target))
+    return LogicalNetwork(mappings)
+
+def random_instance(rng, controls=0):
+    """
+    Small dataset over 4 nodes with random observations, and networks for it
+    """
+    nodes = ["a", "b", "c", "d"]
+    stimuli = nodes[:rng.randint(1, 2)]
+    others = nodes[len(stimuli):]
+    inhibitors = [n for n in others[:1] if rng.random() < .3]
+    # at least one node is left for the readouts
+    candidates = [n for n in others if n not in inhibitors][1:]
+    control_nodes = candidates[max(0, len(candidates)-controls):] \
+                        if controls else []
+    readouts = [n for n in others if n not in control_nodes]
+    readouts = rng.sample(readouts, rng.randint(1, len(readouts)))
+    dataset = Dataset("random", control_nodes=control_nodes)
+    dataset.setup = Setup(stimuli, inhibitors, readouts + control_nodes)
+    dataset.stimulus = set(stimuli)
+    dataset.inhibitors = set(inhibitors)
+    dataset.readout = set(readouts + control_nodes)
+    for eid in range(rng.randint(1, 3)):
+        exp = Experiment(eid)
+        for n in stimuli:
+            exp.add_mutation(n, rng.choice([1, -1]))
+        for n in inhibitors:
+            if rng.random() < .5:
+                exp.add_mutation(n, -1)
+        for t in [0] + sorted(rng.sample(range(1, 10), rng.randint(1, 2))):
+            for n in readouts + control_nodes:
+                if t == 0 and n not in control_nodes and rng.random() < .3:
+                    continue
+                v = rng.choice([0, 1])
+                exp.add_obs(t, n, v, 100*v)
+        dataset.experiments[eid] = exp
+    networks = [random_network(rng, nodes, stimuli) for _ in range(4)]
+    return dataset, networks
+
+@unittest.skipUnless(HAS_NUSMV, "NuSMV is not installed")
+class CheckersTest(unittest.TestCase):
+    """
+    Verdicts of the checkers on random instances
+    """
+    def setUp(self):
+        self.rng = random.Random(0)
+        self.sessions = dict((update, modelchecking.NuSMVSession(update)) \
+                                for update in modelchecking.MODES)
+        fd, self.smvfile = tempfile.mkstemp(".smv")
+        os.close(fd)
+
+    def tearDown(self):
+        for session in self.sessions.values():
+            session.close()
+        os.unlink(self.smvfile)
+
+    def instances(self, count=20, controls=0):
+        for _ in range(count):
+            update = self.rng.choice(modelchecking.MODES)
+            dataset, networks = random_instance(self.rng, controls)
+            yield update, dataset, networks
+
+    def test_native(self):
+        verdicts = set()
+        for update, dataset, networks in self.instances():
+            for network in networks:
+                exact = self.sessions[update].verify(dataset, network)
+                model = native.ExplicitModel(dataset, network, update)
+                self.assertEqual(model.check() is None, exact)
+                verdicts.add(exact)
+        self.assertEqual(verdicts, set([True, False]))
+
+    def test_control_encodings(self):
+        checked = set()
+        for update, dataset, networks in self.instances(10, controls=2):
+            for network in networks:
+                verdicts = set()
+                for encoding in modelchecking.CTL_ENCODINGS:
+                    verdicts.add(modelchecking.verify(dataset, network,
+                                    self.smvfile, update, encoding))
+                self.assertEqual(len(verdicts), 1)
+                checked.update(verdicts)
+        self.assertEqual(checked, set([True, False]))
+
+    def test_batch(self):
+        for update, dataset, networks in self.instances():
+            # the networks of a batch define formulas for the same nodes:
+            # the formulas of the first one are replaced by those of others
+            first = dict(networks[0].formulas_iter())
+            batch = []
+            for network in networks:
+                formulas = dict(first, **dict((n, clauses) for n, clauses \
+                                    in network.formulas_iter() if n in first))
+                batch.append(LogicalNetwork([(c, n) for n, clauses \
+                                    in formulas.items() for c in clauses]))
+            session = self.sessions[update]
+            failing = session.failing_experiments(dataset, batch)
+            for network, eid in zip(batch, failing):
+                single = session.failing_experiment(dataset, network)
+                self.assertEqual(eid is None, single is None)
+                if eid is not None:
+                    self.assertEqual(session.failing_experiment(dataset,
+                                        network, [eid]), eid)
+
+class ReplayedSession(modelchecking.NuSMVSession):
+    """
+    Session reporting the same counterexample for any property
+    """
+    def run(self, func):
+        return func()
+
+    def communicate(self, commands, model=None):
+        if commands[0].startswith("check_ctlspec"):
+            return ["-- specification E0 is false\n", "    net = 0\n"]
+        return []
+
+class BatchCounterexampleTest(unittest.TestCase):
+    def test_failed_network(self):
+        dataset, networks = random_instance(random.Random(0))
+        session = ReplayedSession()
+        try:
+            self.assertRaises(modelchecking.NuSMVError,
+                session.failing_experiments, dataset, networks[:1]*2)
+        finally:
+            session.close()
+
+_sessions = []
+
+def _open_session(tmpdir):
+    _sessions.append(modelchecking.NuSMVSession(tmpdir=tmpdir))
+
+class SessionDirectoryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_close(self):
+        session = modelchecking.NuSMVSession(tmpdir=self.tmpdir)
+        self.assertEqual(os.listdir(self.tmpdir),
+                            [os.path.basename(session.workdir)])
+        session.close()
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_terminated_workers(self):
+        # the sessions of terminated workers are not closed: their
+        # directories are left in tmpdir only
+        pool = multiprocessing.Pool(2, _open_session, (self.tmpdir,))
+        for _ in range(100):
+            if len(os.listdir(self.tmpdir)) == 2:
+                break
+            time.sleep(0.05)
+        pool.terminate()
+        pool.join()
+        self.assertEqual(len(os.listdir(self.tmpdir)), 2)
+
+if __name__ == "__main__":
+    unittest.main()
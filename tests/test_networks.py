@@ -0,0 +1,126 @@
+import itertools
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import gringo
+
+from caspo.core import Graph, HyperGraph, LogicalNetwork
+
+from caspots.asputils import funset
+from caspots.config import aspf
+from caspots.networks import NetworkDecoder, NetworkWriter, hyperedges, \
+                                network_exclusion
+
+DATASETS = os.path.join(os.path.dirname(__file__), "..", "datasets")
+
+def shared_clause_hypergraph():
+    # the clause a is given to the targets c and d
+    return HyperGraph.from_graph(Graph.from_tuples([("a", "c", 1),
+                                                    ("a", "d", 1)]))
+
+class NetworkDecoderTest(unittest.TestCase):
+    def assertDecodes(self, hypergraph, pairs):
+        decoder = NetworkDecoder(hypergraph)
+        network = decoder.network(decoder.positions(pairs))
+        expected = LogicalNetwork.from_hypertuples(hypergraph, pairs)
+        self.assertEqual(list(network.to_array(hypergraph.mappings)),
+                         list(expected.to_array(hypergraph.mappings)))
+
+    def test_shared_clause(self):
+        hg = shared_clause_hypergraph()
+        self.assertEqual(len(hg.clauses_idx), 1)
+        pairs = [(i, j) for j, i in hg.hyper.iteritems()]
+        self.assertEqual(len(pairs), 2)
+        for k in range(len(pairs)+1):
+            for dnf in itertools.combinations(pairs, k):
+                self.assertDecodes(hg, list(dnf))
+
+    def test_pkn(self):
+        graph = Graph.read_sif(os.path.join(DATASETS, "benchmarks-A", "1",
+                                            "pkn1_cmpr.sif"))
+        hg = HyperGraph.from_graph(graph)
+        self.assertLess(len(hg.clauses_idx), len(hg.clauses))
+        pairs = [(i, j) for j, i in hg.hyper.iteritems()]
+        for pair in pairs:
+            self.assertDecodes(hg, [pair])
+        self.assertDecodes(hg, pairs)
+
+    def test_hyperedges(self):
+        hg = shared_clause_hypergraph()
+        edges = hyperedges(hg)
+        self.assertEqual(sorted(edges.values()), sorted(hg.hyper.index))
+        for (clause, target), j in edges.items():
+            self.assertEqual(hg.clauses[j], clause)
+            self.assertEqual(hg.nodes[hg.hyper[j]], target)
+
+class NetworkExclusionTest(unittest.TestCase):
+    def setUp(self):
+        # c has the clauses a, b and a+b; the clause a is shared with d
+        self.hg = HyperGraph.from_graph(Graph.from_tuples([("a", "c", 1),
+                                    ("b", "c", 1), ("a", "d", 1)]))
+        self.decoder = NetworkDecoder(self.hg)
+
+    def networks(self, *constraints):
+        """
+        Networks compatible with the hypergraph, as frozensets of dnf pairs
+        """
+        facts = funset(self.hg).to_str()
+        readouts = "".join('readout("%s").\n' % n for n in ["c", "d"])
+        control = gringo.Control(["0"])
+        control.load(aspf("guessBN.lp"))
+        control.add("base", [], facts + readouts + "#show dnf/2.\n" \
+                                    + "\n".join(constraints))
+        control.ground([("base", [])])
+        found = []
+        control.solve(None, lambda model: found.append(frozenset(
+                    tuple(a.args()) for a in model.atoms() if a.name() == "dnf")))
+        return set(found)
+
+    def network(self, dnf):
+        return self.decoder.network(self.decoder.positions(sorted(dnf)))
+
+    def test_excluded(self):
+        networks = self.networks()
+        self.assertGreater(len(networks), 2)
+        for dnf in networks:
+            network = self.network(dnf)
+            exclusion = network_exclusion(self.hg, network, ["c", "d"])
+            self.assertEqual(self.networks(exclusion), networks - set([dnf]))
+
+    def test_excluded_formula(self):
+        networks = self.networks()
+        def formula(dnf, v):
+            return dict(self.network(dnf).formulas_iter()).get(v)
+        for dnf in networks:
+            exclusion = network_exclusion(self.hg, self.network(dnf), ["d"])
+            self.assertEqual(self.networks(exclusion),
+                set(n for n in networks if formula(n, "d") != formula(dnf, "d")))
+
+class NetworkWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "networks.csv")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_flush(self):
+        hg = shared_clause_hypergraph()
+        decoder = NetworkDecoder(hg)
+        writer = NetworkWriter(self.filename, hg)
+        writer.flush_interval = 0.1
+        try:
+            writer.append(decoder.network([0]))
+            # flushed without any other network
+            time.sleep(0.5)
+            with open(self.filename) as fd:
+                self.assertEqual(len(fd.readlines()), 2)
+        finally:
+            writer.close()
+        self.assertIsNone(writer.timer)
+
+if __name__ == "__main__":
+    unittest.main()